@@ -0,0 +1,123 @@
+import os
+import hashlib
+import logging
+from typing import Optional, Dict, Any, BinaryIO, Tuple
+
+import httpx
+from telegram import File
+
+import http_client
+from cache import TTLCache, SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+AUDD_RECOGNIZE_URL = "https://api.audd.io/recognize"
+
+# Recognition cache settings
+RECOGNITION_CACHE_SIZE = int(os.getenv("RECOGNITION_CACHE_SIZE", "5000"))
+RECOGNITION_CACHE_TTL = int(os.getenv("RECOGNITION_CACHE_TTL", str(7 * 24 * 3600)))
+# Unrecognized clips are cached for a shorter time
+RECOGNITION_MISS_TTL = int(os.getenv("RECOGNITION_MISS_TTL", "3600"))
+# Log cache stats every this many lookups
+STATS_LOG_INTERVAL = 100
+
+
+class RecognitionCache:
+    """Cache of Audd.io results keyed on Telegram's file_unique_id and a content hash."""
+
+    def __init__(self, store: Optional[SQLiteStore] = None):
+        self._cache = TTLCache("audd", max_size=RECOGNITION_CACHE_SIZE, ttl=RECOGNITION_CACHE_TTL, store=store)
+        self.file_hits = 0
+        self.content_hits = 0
+        self.upstream_calls = 0
+
+    async def get_by_file(self, file_unique_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a clip by Telegram's file ID, before downloading it."""
+        entry = await self._cache.get_async(f"file:{file_unique_id}")
+        if entry is not None:
+            self.file_hits += 1
+            self._maybe_log()
+        return entry
+
+    async def get_by_content(self, file_unique_id: str, digest: str) -> Optional[Dict[str, Any]]:
+        """Look up a clip by the hash of its bytes, e.g. the same audio re-uploaded."""
+        entry = await self._cache.get_async(f"sha256:{digest}")
+        if entry is not None:
+            self.content_hits += 1
+            self._cache.set(f"file:{file_unique_id}", entry, self._ttl(entry))
+            self._maybe_log()
+        return entry
+
+    def set(self, file_unique_id: str, digest: str, result: Optional[Dict[str, Any]]) -> None:
+        """Store an upstream result (None if the clip was not recognized)."""
+        self.upstream_calls += 1
+        entry = {'result': result}
+        ttl = self._ttl(entry)
+        self._cache.set(f"file:{file_unique_id}", entry, ttl)
+        self._cache.set(f"sha256:{digest}", entry, ttl)
+        self._maybe_log()
+
+    @staticmethod
+    def _ttl(entry: Dict[str, Any]) -> int:
+        return RECOGNITION_CACHE_TTL if entry.get('result') else RECOGNITION_MISS_TTL
+
+    def _maybe_log(self) -> None:
+        if self.lookups % STATS_LOG_INTERVAL == 0:
+            logger.info(f"Recognition cache stats: {self.stats()}")
+
+    @property
+    def lookups(self) -> int:
+        return self.file_hits + self.content_hits + self.upstream_calls
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit counters; `saved_ratio` is the share of recognitions that skipped Audd.io."""
+        saved = self.file_hits + self.content_hits
+        return {
+            'file_hits': self.file_hits,
+            'content_hits': self.content_hits,
+            'upstream_calls': self.upstream_calls,
+            'saved_ratio': round(saved / self.lookups, 3) if self.lookups else 0.0,
+            'size': len(self._cache)
+        }
+
+
+async def spool_telegram_file(file: File, out: BinaryIO) -> Tuple[int, str]:
+    """Stream a Telegram file into `out` chunk by chunk.
+
+    Returns the size and the SHA-256 hex digest of the content.
+    """
+    digest = hashlib.sha256()
+
+    if not file.file_path.startswith(("http://", "https://")):
+        # Local Bot API server: the file is already on disk
+        with open(file.file_path, "rb") as source:
+            for chunk in iter(lambda: source.read(65536), b""):
+                out.write(chunk)
+                digest.update(chunk)
+        return out.tell(), digest.hexdigest()
+
+    size = 0
+    async with http_client.stream("GET", file.file_path, timeout=30) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            out.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+async def recognize(audio: BinaryIO, filename: str, api_token: str) -> httpx.Response:
+    """Upload an audio file to Audd.io as a streamed multipart body.
+
+    httpx reads the file object in fixed-size chunks while sending, so memory
+    use does not grow with the file size.
+    """
+    audio.seek(0)
+    data = {
+        'api_token': api_token,
+        'return': 'apple_music,spotify'
+    }
+    files = {
+        'file': (os.path.basename(filename) or "audio", audio)
+    }
+    return await http_client.post(AUDD_RECOGNIZE_URL, data=data, files=files, timeout=30)
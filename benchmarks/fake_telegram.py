@@ -0,0 +1,145 @@
+import asyncio
+import itertools
+from typing import Optional, List, Any
+
+# Simulated Telegram Bot API round trip for replies, in seconds
+DEFAULT_API_LATENCY = 0.0
+
+_message_ids = itertools.count(1)
+_file_ids = itertools.count(1)
+
+
+class FakeChat:
+    """Records what the bot sent to one chat."""
+
+    def __init__(self, chat_id: int, api_latency: float = DEFAULT_API_LATENCY):
+        self.id = chat_id
+        self.type = "private"
+        self.api_latency = api_latency
+        self.sent: List[Any] = []
+        self.messages: List["FakeMessage"] = []
+
+    async def record(self, kind: str, payload: Any) -> "FakeMessage":
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        self.sent.append((kind, payload))
+        message = FakeMessage(self, text=payload if kind == "text" else None)
+        if kind == "photo":
+            message.photo = [_photo_size(payload)]
+        self.messages.append(message)
+        return message
+
+
+class FakePhotoSize:
+    def __init__(self, file_id: str):
+        self.file_id = file_id
+
+
+def _photo_size(photo: Any) -> FakePhotoSize:
+    # A photo sent by URL gets a new file_id; one sent by file_id keeps it
+    if isinstance(photo, str) and not photo.startswith(("http://", "https://")):
+        return FakePhotoSize(photo)
+    return FakePhotoSize(f"photo-{next(_file_ids)}")
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.first_name = f"User{user_id}"
+        self.is_bot = False
+
+
+class FakeFile:
+    def __init__(self, file_id: str, file_path: str):
+        self.file_id = file_id
+        self.file_path = file_path
+
+
+class FakeVoice:
+    """Voice attachment; the file downloads from the stubbed Telegram file endpoint."""
+
+    def __init__(self, file_unique_id: str, token: str = "TOKEN"):
+        self.file_id = f"voice-{file_unique_id}"
+        self.file_unique_id = file_unique_id
+        self._file_path = f"https://api.telegram.org/file/bot{token}/voice/{file_unique_id}.oga"
+
+    async def get_file(self) -> FakeFile:
+        return FakeFile(self.file_id, self._file_path)
+
+
+class FakeMessage:
+    """The subset of telegram.Message the handlers use."""
+
+    def __init__(self, chat: FakeChat, text: Optional[str] = None, from_user: Optional[FakeUser] = None, voice: Optional[FakeVoice] = None):
+        self.message_id = next(_message_ids)
+        self.chat = chat
+        self.text = text
+        self.from_user = from_user
+        self.voice = voice
+        self.audio = None
+        self.photo: List[Any] = []
+        self.reply_to_message: Optional["FakeMessage"] = None
+        self.deleted = asyncio.Event()
+
+    async def reply_text(self, text: str, **kwargs: Any) -> "FakeMessage":
+        return await self.chat.record("text", text)
+
+    async def reply_photo(self, photo: Any, caption: Optional[str] = None, **kwargs: Any) -> "FakeMessage":
+        return await self.chat.record("photo", photo)
+
+    async def reply_media_group(self, media: List[Any], **kwargs: Any) -> List["FakeMessage"]:
+        await self.chat.record("media_group", [item.media for item in media])
+        messages = []
+        for item in media:
+            message = FakeMessage(self.chat)
+            message.photo = [_photo_size(item.media)]
+            messages.append(message)
+        return messages
+
+    async def edit_text(self, text: str, **kwargs: Any) -> "FakeMessage":
+        return await self.chat.record("edit", text)
+
+    async def delete(self) -> bool:
+        self.deleted.set()
+        return True
+
+
+class FakeUpdate:
+    """The subset of telegram.Update the handlers use."""
+
+    def __init__(self, update_id: int, message: FakeMessage):
+        self.update_id = update_id
+        self.message = message
+        self.effective_message = message
+        self.effective_chat = message.chat
+        self.effective_user = message.from_user
+        self.callback_query = None
+
+
+class FakeBot:
+    """Stands in for context.bot; photos sent here go to the chat's log."""
+
+    def __init__(self, chats: "dict[int, FakeChat]"):
+        self._chats = chats
+
+    async def send_photo(self, chat_id: int, photo: Any, caption: Optional[str] = None, **kwargs: Any) -> FakeMessage:
+        return await self._chats[chat_id].record("photo", photo)
+
+    async def get_file(self, file_id: str) -> FakeFile:
+        return FakeFile(file_id, f"https://api.telegram.org/file/botTOKEN/photos/{file_id}.jpg")
+
+
+class FakeContext:
+    """The subset of ContextTypes.DEFAULT_TYPE the handlers use."""
+
+    def __init__(self, bot: FakeBot, args: List[str]):
+        self.bot = bot
+        self.args = args
+
+
+def make_command(update_id: int, chat: FakeChat, user_id: int, text: str) -> FakeUpdate:
+    return FakeUpdate(update_id, FakeMessage(chat, text=text, from_user=FakeUser(user_id)))
+
+
+def make_voice(update_id: int, chat: FakeChat, user_id: int, file_unique_id: str) -> FakeUpdate:
+    return FakeUpdate(update_id, FakeMessage(chat, from_user=FakeUser(user_id), voice=FakeVoice(file_unique_id)))
@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+from typing import Dict, List, Any, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_upstreams import start_in_subprocess, parse_latency, RerouteTransport
+from benchmarks.fake_telegram import FakeChat, FakeBot, FakeContext, make_command, make_voice
+
+# Default traffic mix, as relative weights
+DEFAULT_MIX = "dalle=2,song=2,genre=2,similar=2,whois=2,gemma=2,voice=1"
+
+# Arguments each command is called with, picked at random
+CORPUS = {
+    "dalle": ["bir kedi ağaca tırmanıyor", "denizde gün batımı", "uzayda bir astronot", "yağmurda İstanbul"],
+    "flux": ["bir kedi ağaca tırmanıyor", "dağlarda bir kulübe", "neon ışıklı bir şehir", "x4 uzayda bir astronot"],
+    "song": ["Hadise Aşk Kaç Beden Giyer", "Tarkan Şımarık", "Sezen Aksu Gidiyorum", "Barış Manço Gülpembe"],
+    "genre": ["aksiyon", "macera", "animasyon", "komedi", "korku", "bilim kurgu"],
+    "similar": ["Matrix", "Inception", "Interstellar", "Yüzüklerin Efendisi", "Esaretin Bedeli"],
+    "whois": ["google.com", "example.org", "python.org", "wikipedia.org", "github.com"],
+    "gemma": ["merhaba", "bugün hava nasıl", "bana bir şiir yaz", "Python nedir"]
+}
+
+# Commands that finish in the background; done when their processing message is deleted
+BACKGROUND_PREFIXES = {"flux": "🔄"}
+
+# Replies that mean the request failed or was rejected
+ERROR_PREFIXES = ("❌", "⚠️", "🔌", "⏰", "Çok fazla", "Bir hata")
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, weight = item.split("=", 1)
+            mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """Settings the bot module reads at import time."""
+    defaults = {
+        "TELEGRAM_TOKEN": "0:benchmark",
+        "REPLICATE_API_TOKEN": "benchmark",
+        "AUDD_API_TOKEN": "benchmark",
+        "TMDB_API_KEY": "benchmark",
+        "STATE_BACKEND": "memory",
+        "METRICS_PORT": "0",
+        "LOG_FILE": "",
+        "LOG_LEVEL": args.log_level,
+        "RATE_LIMITS": "",
+        "TMDB_PREWARM": "0",
+        "REPLICATE_POLL_INTERVAL": "0.05"
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+class Benchmark:
+    def __init__(self, bot: Any, args: argparse.Namespace):
+        self.bot = bot
+        self.args = args
+        self.handlers = {
+            "dalle": bot.generate_dalle,
+            "flux": bot.generate_flux,
+            "song": bot.search_song,
+            "genre": bot.genre_movies,
+            "similar": bot.similar_movies,
+            "whois": bot.whois_lookup,
+            "gemma": bot.gemma_command,
+            "voice": bot.recognize_music
+        }
+        self.chats: Dict[int, FakeChat] = {}
+        self.fake_bot = FakeBot(self.chats)
+        # command -> [(latency, ok)]
+        self.results: Dict[str, List[Tuple[float, bool]]] = {name: [] for name in self.handlers}
+
+    def _build(self, update_id: int, command: str) -> Tuple[Any, FakeContext, FakeChat]:
+        chat = FakeChat(update_id, self.args.telegram_latency)
+        self.chats[update_id] = chat
+        user_id = random.randrange(1, self.args.users + 1)
+        if command == "voice":
+            # A limited pool of clips, so repeats exercise the recognition cache
+            clip = f"clip{random.randrange(self.args.voice_clips)}"
+            return make_voice(update_id, chat, user_id, clip), FakeContext(self.fake_bot, []), chat
+        argument = random.choice(CORPUS[command])
+        update = make_command(update_id, chat, user_id, f"/{command} {argument}")
+        return update, FakeContext(self.fake_bot, argument.split()), chat
+
+    async def _run_one(self, update_id: int, command: str, processor: Any) -> None:
+        update, context, chat = self._build(update_id, command)
+        started = time.perf_counter()
+        await processor.process_update(update, self.handlers[command](update, context))
+
+        prefix = BACKGROUND_PREFIXES.get(command)
+        if prefix:
+            for message in chat.messages:
+                if message.text and message.text.startswith(prefix):
+                    await asyncio.wait_for(message.deleted.wait(), self.args.timeout)
+
+        latency = time.perf_counter() - started
+        ok = not any(kind == "text" and str(payload).startswith(ERROR_PREFIXES) for kind, payload in chat.sent)
+        self.results[command].append((latency, ok))
+        del self.chats[update_id]
+
+    async def run(self) -> Dict[str, Any]:
+        from dispatcher import PerChatUpdateProcessor
+
+        mix = parse_mix(self.args.mix)
+        commands = random.choices(list(mix), weights=list(mix.values()), k=self.args.requests)
+
+        processor = PerChatUpdateProcessor(self.args.concurrency)
+        await processor.initialize()
+
+        baseline_rss = current_rss_mb()
+        started = time.perf_counter()
+        tasks = []
+        for update_id, command in enumerate(commands, 1):
+            tasks.append(asyncio.create_task(self._run_one(update_id, command, processor)))
+            if self.args.rate:
+                # Open loop: requests arrive at a fixed rate whatever the latency
+                await asyncio.sleep(1 / self.args.rate)
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+
+        failures = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        return self._report(elapsed, baseline_rss, failures)
+
+    def _report(self, elapsed: float, baseline_rss: float, failures: List[Exception]) -> Dict[str, Any]:
+        def summarize(samples: List[Tuple[float, bool]]) -> Dict[str, Any]:
+            latencies = [latency for latency, _ in samples]
+            return {
+                'count': len(samples),
+                'errors': sum(1 for _, ok in samples if not ok),
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                'max_ms': round(max(latencies, default=0) * 1000, 1)
+            }
+
+        all_samples = [sample for samples in self.results.values() for sample in samples]
+        return {
+            'requests': len(all_samples),
+            'harness_failures': len(failures),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(all_samples) / elapsed, 1) if elapsed else 0.0,
+            'overall': summarize(all_samples),
+            'commands': {name: summarize(samples) for name, samples in self.results.items() if samples},
+            'baseline_rss_mb': round(baseline_rss, 1),
+            'peak_rss_mb': round(peak_rss_mb(), 1)
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n{report['requests']} requests in {report['elapsed_s']}s -> {report['throughput_rps']} req/s")
+    print(f"{'command':<10}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = list(report['commands'].items()) + [("overall", report['overall'])]
+    for name, row in rows:
+        print(f"{name:<10}{row['count']:>8}{row['errors']:>8}{row['p50_ms']:>10}{row['p99_ms']:>10}{row['max_ms']:>10}")
+    print(f"RSS: {report['baseline_rss_mb']} MB at start, {report['peak_rss_mb']} MB peak")
+    if report['harness_failures']:
+        print(f"Harness failures: {report['harness_failures']}")
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    configure_environment(args)
+    process, stub_url = start_in_subprocess(parse_latency(args.latency), args.jitter)
+    try:
+        import http_client
+        import image_generator_bot as bot
+        from replicate_jobs import ReplicateJobEngine
+
+        # Every outbound call, including Replicate's own client, goes to the stubs
+        http_client.use_transport(RerouteTransport(stub_url))
+        bot.replicate_engine = ReplicateJobEngine(
+            bot.REPLICATE_API_TOKEN,
+            transport=RerouteTransport(stub_url)
+        )
+        bot.flux_queue.engine = bot.replicate_engine
+
+        try:
+            return await Benchmark(bot, args).run()
+        finally:
+            await bot.replicate_engine.close()
+            await http_client.close()
+    finally:
+        process.terminate()
+
+
+if __name__ == '__main__':
+    # python -m benchmarks.run_benchmark --requests 500 --mix "genre=1,voice=1" --latency "all=0.05"
+    parser = argparse.ArgumentParser(description="Drive the bot's handlers against local stub upstreams")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f'weights per command, default "{DEFAULT_MIX}"; also "flux"')
+    parser.add_argument("--concurrency", type=int, default=32, help="updates processed at once, as MAX_CONCURRENT_UPDATES")
+    parser.add_argument("--rate", type=float, default=0, help="arrivals per second; 0 sends everything at once")
+    parser.add_argument("--users", type=int, default=1000, help="distinct users, which affects rate limits and quotas")
+    parser.add_argument("--voice-clips", type=int, default=50, help="distinct voice clips, which affects cache hits")
+    parser.add_argument("--latency", default="", help='upstream latency overrides, e.g. "tmdb=0.05,audd=1.5" or "all=0"')
+    parser.add_argument("--jitter", type=float, default=0.1, help="latency standard deviation as a share of the mean")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="simulated Bot API latency per reply")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(main(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(report, output, indent=2)
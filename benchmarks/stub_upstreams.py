@@ -0,0 +1,329 @@
+import os
+import re
+import sys
+import json
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+import multiprocessing
+import urllib.parse
+from typing import Optional, Dict, Any, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Upstream names used in latency specs, by the host the bot calls
+UPSTREAM_HOSTS = {
+    "prompt.glitchy.workers.dev": "dalle",
+    "jiosaavn-api-codyandersan.vercel.app": "jiosaavn",
+    "rdap.org": "rdap",
+    "data.iana.org": "iana",
+    "apilonic.netlify.app": "gemma",
+    "api.themoviedb.org": "tmdb",
+    "api.audd.io": "audd",
+    "api.telegram.org": "telegram",
+    "api.replicate.com": "replicate",
+    "www.youtube.com": "youtube"
+}
+
+# Default latency per upstream in seconds, roughly what production sees
+DEFAULT_LATENCY = {
+    "dalle": 2.0,
+    "jiosaavn": 0.4,
+    "rdap": 0.3,
+    "iana": 0.2,
+    "gemma": 1.5,
+    "tmdb": 0.15,
+    "audd": 1.0,
+    "telegram": 0.05,
+    "replicate": 0.1,
+    "youtube": 0.1
+}
+
+# Size of the fake voice file served for Telegram file downloads
+VOICE_FILE_SIZE = 64 * 1024
+# Polls before a fake Replicate prediction succeeds
+REPLICATE_POLLS = 2
+
+REASONS = {200: "OK", 201: "Created", 404: "Not Found"}
+
+
+# TLDs in the fake RDAP bootstrap file, all served by one fake registry
+BOOTSTRAP_TLDS = ["com", "net", "org", "io", "dev"]
+
+
+def upstream_for(host: str) -> str:
+    if host in UPSTREAM_HOSTS:
+        return UPSTREAM_HOSTS[host]
+    # Registry RDAP servers from the bootstrap file
+    if host.startswith("rdap."):
+        return "rdap"
+    return "unknown"
+
+
+def parse_latency(spec: str) -> Dict[str, float]:
+    """Parse "tmdb=0.05,audd=1.5" into {upstream: seconds} on top of the defaults."""
+    latency = dict(DEFAULT_LATENCY)
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, seconds = item.split("=", 1)
+        if name.strip() == "all":
+            latency = {key: float(seconds) for key in latency}
+        else:
+            latency[name.strip()] = float(seconds)
+    return latency
+
+
+def _movie(movie_id: int) -> Dict[str, Any]:
+    return {
+        'id': movie_id,
+        'title': f"Film {movie_id}",
+        'overview': "Sahte bir film özeti. " * 10,
+        'release_date': "2020-01-01",
+        'vote_average': 7.5,
+        'poster_path': f"/poster{movie_id}.jpg"
+    }
+
+
+class StubUpstreams:
+    """One HTTP server answering for every upstream API the bot calls.
+
+    Requests are told apart by their Host header, which RerouteTransport keeps
+    when it points the bot's requests at this server. Each answer is delayed
+    by the configured latency (plus jitter) for its upstream.
+    """
+
+    def __init__(self, latency: Optional[Dict[str, float]] = None, jitter: float = 0.1, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency or dict(DEFAULT_LATENCY)
+        self.jitter = jitter
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._predictions: Dict[str, int] = {}
+        self._outputs: Dict[str, int] = {}
+        self._prediction_ids = itertools.count(1)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await self._read_body(reader, headers)
+
+                self.requests += 1
+                upstream = upstream_for(headers.get("host", "").split(":")[0])
+                delay = self.latency.get(upstream, 0.0)
+                if delay:
+                    await asyncio.sleep(max(0.0, random.gauss(delay, delay * self.jitter)))
+
+                status, content, content_type = self._route(upstream, method, target, body)
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(content)}\r\n\r\n".encode("latin-1") + content
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> bytes:
+        # Only small JSON bodies are kept; uploads are read and discarded
+        chunks = []
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    return b""
+        length = int(headers.get("content-length", "0"))
+        keep = "json" in headers.get("content-type", "")
+        while length > 0:
+            chunk = await reader.read(min(length, 65536))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", length)
+            if keep:
+                chunks.append(chunk)
+            length -= len(chunk)
+        return b"".join(chunks)
+
+    def _route(self, upstream: str, method: str, target: str, body: bytes = b"") -> Tuple[int, bytes, str]:
+        url = urllib.parse.urlparse(target)
+        query = urllib.parse.parse_qs(url.query)
+
+        if upstream == "telegram":
+            return 200, b"\0" * VOICE_FILE_SIZE, "application/octet-stream"
+        if upstream == "replicate":
+            return self._replicate(method, url.path, body)
+
+        if upstream == "dalle":
+            data = {'status': 1, 'images': [{'imagedemo1': [f"https://example.com/dalle/{random.randrange(10**9)}.png"]}]}
+        elif upstream == "jiosaavn":
+            song = {
+                'title': query.get('query', ["Şarkı"])[0],
+                'primaryArtists': "Sanatçı",
+                'album': "Albüm",
+                'url': "https://example.com/song",
+                'image': [{'link': "https://example.com/song.jpg"}]
+            }
+            album = {'title': "Albüm", 'artist': "Sanatçı", 'year': "2020", 'url': "https://example.com/album"}
+            data = {'status': "SUCCESS", 'data': {'songs': {'results': [song] * 3}, 'albums': {'results': [album] * 2}}}
+        elif upstream == "rdap":
+            domain = url.path.rsplit("/", 1)[-1]
+            data = {
+                'ldhName': domain,
+                'status': ["active", "client transfer prohibited"],
+                'events': [
+                    {'eventAction': "registration", 'eventDate': "2000-01-01T00:00:00Z"},
+                    {'eventAction': "expiration", 'eventDate': "2030-01-01T00:00:00Z"}
+                ],
+                'nameservers': [{'ldhName': f"ns{i}.{domain}"} for i in range(1, 5)],
+                'entities': [{'roles': ["registrar"], 'vcardArray': ["vcard", [["fn", {}, "text", "Registrar Inc."]]]}],
+                'port43': "whois.example.com"
+            }
+        elif upstream == "iana":
+            data = {'version': "1.0", 'services': [[BOOTSTRAP_TLDS, ["https://rdap.registry.test/v1/"]]]}
+        elif upstream == "gemma":
+            data = {'success': True, 'response': "Merhaba! " * 20}
+        elif upstream == "tmdb":
+            if url.path.endswith("/search/movie"):
+                data = {'results': [_movie(random.randrange(1, 1000))]}
+            else:
+                data = {'results': [_movie(random.randrange(1, 1000)) for _ in range(20)]}
+        elif upstream == "audd":
+            data = {'status': "success", 'result': {
+                'artist': "Sanatçı",
+                'title': "Şarkı",
+                'album': "Albüm",
+                'release_date': "2020-01-01",
+                'spotify': {'external_urls': {'spotify': "https://example.com/spotify"}, 'album': {'images': [{'url': "https://example.com/cover.jpg"}]}}
+            }}
+        elif upstream == "youtube" and url.path == "/oembed":
+            data = {'title': "Video", 'author_name': "Kanal"}
+        else:
+            return 404, b"", "text/plain"
+        return 200, json.dumps(data).encode("utf-8"), "application/json"
+
+    def _replicate(self, method: str, path: str, body: bytes) -> Tuple[int, bytes, str]:
+        if method == "POST" and path.rstrip("/").endswith("/predictions"):
+            prediction_id = f"p{next(self._prediction_ids)}"
+            self._predictions[prediction_id] = 0
+            try:
+                outputs = int(json.loads(body)['input'].get('num_outputs', 1))
+            except (ValueError, KeyError, TypeError):
+                outputs = 1
+            self._outputs[prediction_id] = outputs
+            return 201, json.dumps(self._prediction(prediction_id, "starting")).encode("utf-8"), "application/json"
+
+        match = re.search(r"/predictions/([^/]+)(/cancel)?$", path)
+        if not match or match.group(1) not in self._predictions:
+            return 404, b"", "text/plain"
+        prediction_id = match.group(1)
+        if match.group(2):
+            self._predictions.pop(prediction_id, None)
+            self._outputs.pop(prediction_id, None)
+            return 200, json.dumps(self._prediction(prediction_id, "canceled")).encode("utf-8"), "application/json"
+
+        self._predictions[prediction_id] += 1
+        if self._predictions[prediction_id] < REPLICATE_POLLS:
+            return 200, json.dumps(self._prediction(prediction_id, "processing")).encode("utf-8"), "application/json"
+        del self._predictions[prediction_id]
+        outputs = self._outputs.pop(prediction_id, 1)
+        output = [f"https://example.com/replicate/{prediction_id}-{i}.png" for i in range(outputs)]
+        return 200, json.dumps(self._prediction(prediction_id, "succeeded", output)).encode("utf-8"), "application/json"
+
+    @staticmethod
+    def _prediction(prediction_id: str, status: str, output: Any = None) -> Dict[str, Any]:
+        return {
+            'id': prediction_id,
+            'model': "stub/model",
+            'version': "stub",
+            'status': status,
+            'input': {},
+            'output': output,
+            'error': None,
+            'logs': "",
+            'created_at': "2024-01-01T00:00:00Z",
+            'urls': {}
+        }
+
+
+class RerouteTransport(httpx.AsyncHTTPTransport):
+    """Transport sending every request to the stub server, keeping the original Host header."""
+
+    def __init__(self, stub_url: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        stub = httpx.URL(stub_url)
+        self._host = stub.host
+        self._port = stub.port
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme="http", host=self._host, port=self._port)
+        return await super().handle_async_request(request)
+
+
+def _serve(latency: Dict[str, float], jitter: float, ready: "multiprocessing.Queue") -> None:
+    async def serve() -> None:
+        stubs = StubUpstreams(latency, jitter)
+        ready.put(await stubs.start())
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def start_in_subprocess(latency: Dict[str, float], jitter: float = 0.1) -> Tuple[multiprocessing.Process, str]:
+    """Run the stubs in their own process so they don't share the bot's CPU or memory."""
+    ready: "multiprocessing.Queue" = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(latency, jitter, ready), daemon=True)
+    process.start()
+    port = ready.get(timeout=10)
+    return process, f"http://127.0.0.1:{port}"
+
+
+if __name__ == '__main__':
+    # Standalone stubs: python -m benchmarks.stub_upstreams --port 8080 --latency tmdb=0.05
+    parser = argparse.ArgumentParser(description="Serve fake upstream APIs for the bot")
+    parser.add_argument("--port", type=int, default=int(os.getenv("STUB_PORT", "8080")))
+    parser.add_argument("--latency", default="", help='e.g. "tmdb=0.05,audd=1.5" or "all=0"')
+    parser.add_argument("--jitter", type=float, default=0.1)
+    args = parser.parse_args()
+
+    async def main() -> None:
+        stubs = StubUpstreams(parse_latency(args.latency), args.jitter, port=args.port)
+        print(f"Stub upstreams listening on http://127.0.0.1:{await stubs.start()}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(0)
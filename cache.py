@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Tuple, Type, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Default on-disk location for persistent caches
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "bot_cache.db")
+
+# Purge expired rows from disk every this many writes
+DISK_PURGE_INTERVAL = 500
+
+# Store writes run in order on one background thread, so they never block the event loop
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-writer")
+
+_MISSING = object()
+
+
+class StoreError(Exception):
+    """A cache store could not be read or written; caches treat it as a miss."""
+
+
+@contextmanager
+def store_errors(*errors: Type[BaseException]) -> Iterator[None]:
+    """Re-raise a store's own exceptions as StoreError."""
+    try:
+        yield
+    except errors as e:
+        raise StoreError(str(e)) from e
+
+
+def flush_writes() -> None:
+    """Wait for queued store writes, e.g. before the store is closed."""
+    _writer.submit(lambda: None).result()
+
+
+class SQLiteStore:
+    """Small key/value store with expiry, shared by persistent caches.
+
+    Errors from SQLite are raised as StoreError.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, expires_at) for a live entry, or None."""
+        with self._lock, store_errors(sqlite3.Error):
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, namespace: str, key: str, value: Any, expires_at: float) -> None:
+        with self._lock, store_errors(sqlite3.Error):
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at)
+            )
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock, store_errors(sqlite3.Error):
+            self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def purge(self, namespace: str, max_size: int) -> None:
+        """Drop expired rows and keep at most max_size rows for the namespace."""
+        with self._lock, store_errors(sqlite3.Error):
+            self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires_at <= ?",
+                (namespace, time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key NOT IN ("
+                " SELECT key FROM cache WHERE namespace = ? ORDER BY expires_at DESC LIMIT ?)",
+                (namespace, namespace, max_size)
+            )
+
+    def clear(self, namespace: str) -> None:
+        with self._lock, store_errors(sqlite3.Error):
+            self._conn.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class TTLCache:
+    """Size- and TTL-bounded LRU cache with optional SQLite persistence.
+
+    Values must be JSON serializable when a store is attached. Writes reach
+    the store in the background; from async code, get_async() reads it off
+    the event loop. A store that fails (StoreError) counts as a miss.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_size: int = 1000,
+        ttl: float = 3600,
+        store: Optional[SQLiteStore] = None,
+        disk_max_size: Optional[int] = None
+    ):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self.disk_max_size = disk_max_size or max_size * 10
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._writes = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the cached value, refreshing its LRU position."""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            return value
+        if self.store is not None:
+            stored = self._read(key)
+            if stored is not None:
+                return self._loaded(key, stored)
+        self.misses += 1
+        return default
+
+    async def get_async(self, key: str, default: Any = None) -> Any:
+        """get(), reading the store in a worker thread when the key is not in memory."""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            return value
+        if self.store is not None:
+            stored = await asyncio.to_thread(self._read, key)
+            if stored is not None:
+                return self._loaded(key, stored)
+        self.misses += 1
+        return default
+
+    def _lookup(self, key: str) -> Any:
+        entry = self._data.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > time.time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        return _MISSING
+
+    def _read(self, key: str) -> Optional[Tuple[Any, float]]:
+        try:
+            return self.store.get(self.name, key)
+        except StoreError as e:
+            logger.warning(f"Cache store read error ({self.name}): {str(e)}")
+            return None
+
+    def _loaded(self, key: str, stored: Tuple[Any, float]) -> Any:
+        self._remember(key, stored[0], stored[1])
+        self.hits += 1
+        return stored[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value, evicting the least recently used entries if full.
+
+        The store is written in the background.
+        """
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        self._remember(key, value, expires_at)
+        if self.store is not None:
+            _writer.submit(self._write, key, value, expires_at)
+
+    def _write(self, key: str, value: Any, expires_at: float) -> None:
+        try:
+            self.store.set(self.name, key, value, expires_at)
+            self._writes += 1
+            if self._writes % DISK_PURGE_INTERVAL == 0:
+                self.store.purge(self.name, self.disk_max_size)
+        except (StoreError, TypeError, ValueError) as e:
+            logger.warning(f"Cache store write error ({self.name}): {str(e)}")
+
+    def _remember(self, key: str, value: Any, expires_at: float) -> None:
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+        if self.store is not None:
+            _writer.submit(self._store_call, "delete", self.store.delete, self.name, key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        if self.store is not None:
+            _writer.submit(self._store_call, "clear", self.store.clear, self.name)
+
+    def _store_call(self, action: str, call: Any, *args: Any) -> None:
+        try:
+            call(*args)
+        except StoreError as e:
+            logger.warning(f"Cache store {action} error ({self.name}): {str(e)}")
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return counters for logging and monitoring."""
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hit_ratio, 3)
+        }
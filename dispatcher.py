@@ -0,0 +1,110 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, Awaitable, AsyncIterator, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Updates processed at the same time across all chats (1 = sequential)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+# Updates allowed to wait for their chat's turn, per concurrent slot
+PENDING_PER_SLOT = 8
+
+# The concurrency slot held by the update being processed, and the task holding it
+_current_slot: ContextVar[Optional[Tuple[asyncio.Semaphore, asyncio.Task]]] = ContextVar("dispatcher_slot", default=None)
+
+
+@asynccontextmanager
+async def released_slot() -> AsyncIterator[None]:
+    """Give the current update's concurrency slot back for the duration of the block.
+
+    For handlers about to wait a long time (e.g. in a job queue), so other
+    chats can use the slot meanwhile. Does nothing outside an update, and in
+    background tasks that merely inherited the update's context.
+    """
+    current = _current_slot.get()
+    if current is None or current[1] is not asyncio.current_task():
+        yield
+        return
+    slot = current[0]
+    slot.release()
+    try:
+        yield
+    finally:
+        await slot.acquire()
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats in parallel, and each chat's updates in order.
+
+    Every chat has a FIFO lock, so a user's later command always waits for
+    their earlier one. The global cap is taken only after the chat's turn has
+    come, so a chat with a backlog does not hold slots other chats could use.
+    The base class semaphore bounds how many updates may be waiting in total.
+
+    The exception is an update whose handler hands a job to the scheduler's
+    background queue (/flux, /upscale): it is done once the job is queued.
+    Such jobs stay in order among themselves (see Scheduler.submit), but a
+    later cheap command may be answered before the job's result.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates * PENDING_PER_SLOT)
+        self.concurrency = max_concurrent_updates
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_waiters: Dict[int, int] = {}
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await self._run(coroutine)
+            return
+
+        lock = self._chat_locks.get(key)
+        if lock is None:
+            lock = self._chat_locks[key] = asyncio.Lock()
+        self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._slots:
+                    await self._run(coroutine)
+        finally:
+            # Forget idle chats so the table only holds chats with pending updates
+            self._chat_waiters[key] -= 1
+            if self._chat_waiters[key] == 0:
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        token = _current_slot.set((self._slots, asyncio.current_task()))
+        try:
+            await coroutine
+        finally:
+            _current_slot.reset(token)
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._chat_locks)
+
+    async def initialize(self) -> None:
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,117 @@
+import time
+import asyncio
+import logging
+import functools
+import importlib
+import importlib.util
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+
+class Feature:
+    """An optional backend module used by one or more commands."""
+
+    def __init__(self, name: str, module: str, commands: List[str], required: bool = True):
+        self.name = name
+        self.module = module
+        self.commands = commands
+        # Optional features only improve a command; it keeps working without them
+        self.required = required
+        self.installed = importlib.util.find_spec(module.split(".")[0]) is not None
+        self.loaded: Optional[Any] = None
+        self.load_seconds = 0.0
+        self.error: Optional[str] = None if self.installed else "not installed"
+
+    @property
+    def available(self) -> bool:
+        return self.installed and self.error is None
+
+
+# Registered features by name
+_features: Dict[str, Feature] = {}
+
+
+def register(name: str, module: str, commands: List[str], required: bool = True) -> Feature:
+    """Declare a feature; this only checks the module is installed, it does not import it."""
+    feature = Feature(name, module, commands, required)
+    _features[name] = feature
+    return feature
+
+
+def available(name: str) -> bool:
+    feature = _features.get(name)
+    return feature is not None and feature.available
+
+
+def load(name: str) -> Any:
+    """Import a feature's module on first use and return it."""
+    feature = _features[name]
+    if feature.loaded is not None:
+        return feature.loaded
+    if not feature.available:
+        raise ImportError(f"Feature {name} is unavailable: {feature.error}")
+
+    started = time.perf_counter()
+    try:
+        feature.loaded = importlib.import_module(feature.module)
+    except ImportError as e:
+        feature.error = str(e)
+        logger.error(f"Feature {name} failed to load: {str(e)}")
+        raise
+    feature.load_seconds = time.perf_counter() - started
+    logger.info(f"Loaded {feature.module} for {name} in {feature.load_seconds * 1000:.0f} ms")
+    return feature.loaded
+
+
+def disabled_commands() -> List[str]:
+    """Commands that cannot run because a required feature is missing."""
+    return [
+        command
+        for feature in _features.values()
+        if feature.required and not feature.available
+        for command in feature.commands
+    ]
+
+
+def report() -> Dict[str, Dict[str, Any]]:
+    """State of every feature, for the startup log."""
+    return {
+        name: {
+            'module': feature.module,
+            'available': feature.available,
+            'loaded': feature.loaded is not None,
+            'load_ms': round(feature.load_seconds * 1000),
+            'error': feature.error
+        }
+        for name, feature in _features.items()
+    }
+
+
+def requires(name: str) -> Callable:
+    """Decorator loading a feature before a handler runs, replying if it is unavailable."""
+    def decorator(handler: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            try:
+                if _features[name].loaded is None:
+                    # First use: import off the event loop so other chats are not held up
+                    await asyncio.to_thread(load, name)
+            except ImportError:
+                if update.effective_message is not None:
+                    await update.effective_message.reply_text(
+                        "❌ Bu komut şu anda kullanılamıyor."
+                    )
+                return
+            return await handler(update, context)
+        return wrapper
+    return decorator
+
+
+# Backends imported on demand; pytube is only the last fallback for /yt metadata
+register("replicate", "replicate", ["flux", "upscale"])
+register("speedtest", "speedtest", ["speedtest"])
+register("pytube", "pytube", ["yt"], required=False)
@@ -0,0 +1,195 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import urllib.parse
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, AsyncIterator, Tuple
+
+import httpx
+
+import metrics
+import upstream_health
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "10"))
+HTTP_DEFAULT_TIMEOUT = float(os.getenv("HTTP_DEFAULT_TIMEOUT", "30"))
+
+# GET retries after failed connections and these statuses, with jittered backoff.
+# A timed-out request is not retried: the upstream may still be working on it.
+HTTP_GET_RETRIES = int(os.getenv("HTTP_GET_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.2"))
+RETRY_STATUSES = {502, 503, 504}
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# Exceptions raised by the client, re-exported so handlers don't need httpx
+Timeout = httpx.TimeoutException
+RequestError = httpx.HTTPError
+
+_client: Optional[httpx.AsyncClient] = None
+# Custom transport for the shared client, e.g. local stub servers in benchmarks
+_transport: Optional[httpx.AsyncBaseTransport] = None
+_host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared AsyncClient, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            timeout=HTTP_DEFAULT_TIMEOUT,
+            follow_redirects=True,
+            transport=_transport,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            )
+        )
+    return _client
+
+
+def use_transport(transport: Optional[httpx.AsyncBaseTransport]) -> None:
+    """Send requests through `transport`; call before the first request is made."""
+    global _transport
+    _transport = transport
+
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    """Get the semaphore limiting concurrent requests to the URL's host."""
+    host = urllib.parse.urlparse(url).netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(HTTP_PER_HOST_LIMIT)
+        _host_semaphores[host] = semaphore
+    return semaphore
+
+
+async def request(method: str, url: str, retry: bool = True, **kwargs: Any) -> httpx.Response:
+    """Send a request through the shared client, respecting the per-host limit.
+
+    Calls to an upstream whose circuit is open fail at once with
+    upstream_health.CircuitOpenError. A numeric `timeout` is the ceiling for
+    the upstream's adaptive timeout, and for all attempts together. GETs
+    that could not connect or got a 502/503/504 are retried with full-jitter
+    exponential backoff; pass retry=False for requests that start costly
+    work upstream.
+    """
+    health = upstream_health.get(metrics.upstream_name(url))
+    ceiling = kwargs.pop("timeout", HTTP_DEFAULT_TIMEOUT)
+    budget = ceiling if isinstance(ceiling, (int, float)) else HTTP_DEFAULT_TIMEOUT
+    deadline = time.monotonic() + budget
+    attempts = 1 + (HTTP_GET_RETRIES if method == "GET" and retry else 0)
+    response: Optional[httpx.Response] = None
+    error: Optional[Exception] = None
+
+    for attempt in range(attempts):
+        health.before_call()
+        if isinstance(ceiling, (int, float)):
+            timeout = max(0.001, min(health.timeout(ceiling), deadline - time.monotonic()))
+        else:
+            timeout = ceiling
+        last = attempt == attempts - 1
+        try:
+            response = await _send(health, method, url, timeout=timeout, **kwargs)
+        except RETRY_ERRORS as e:
+            if last:
+                raise
+            response, error = None, e
+        else:
+            if response.status_code not in RETRY_STATUSES or last:
+                return response
+
+        backoff = random.uniform(0, HTTP_RETRY_BACKOFF * 2 ** attempt)
+        if time.monotonic() + backoff >= deadline:
+            # No time left for another attempt
+            if response is not None:
+                return response
+            raise error
+        await asyncio.sleep(backoff)
+
+
+async def _send(health: upstream_health.UpstreamHealth, method: str, url: str, **kwargs: Any) -> httpx.Response:
+    async with _host_semaphore(url):
+        with metrics.UpstreamTimer(health.name) as call:
+            started = time.perf_counter()
+            try:
+                response = await get_client().request(method, url, **kwargs)
+            except httpx.TransportError:
+                health.record_failure()
+                raise
+            call.status = str(response.status_code)
+
+    if upstream_health.is_failure_status(response.status_code):
+        health.record_failure()
+    else:
+        health.record_success(time.perf_counter() - started)
+    return response
+
+
+async def get(url: str, **kwargs: Any) -> httpx.Response:
+    """Send a GET request."""
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs: Any) -> httpx.Response:
+    """Send a POST request."""
+    return await request("POST", url, **kwargs)
+
+
+async def get_json(url: str, **kwargs: Any) -> Tuple[int, Any]:
+    """GET a URL and decode the body of a 200 response.
+
+    Returns the status code and the JSON data (None for other statuses);
+    raises ValueError if a 200 body is not valid JSON.
+    """
+    response = await get(url, **kwargs)
+    if response.status_code != 200:
+        return response.status_code, None
+    return response.status_code, response.json()
+
+
+@asynccontextmanager
+async def stream(method: str, url: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+    """Open a streamed response; the body is read incrementally by the caller."""
+    health = upstream_health.get(metrics.upstream_name(url))
+    health.before_call()
+    async with _host_semaphore(url):
+        # Timed until the caller has finished reading the body
+        with metrics.UpstreamTimer(health.name) as call:
+            try:
+                response_context = get_client().stream(method, url, **kwargs)
+                response = await response_context.__aenter__()
+            except httpx.TransportError:
+                health.record_failure()
+                raise
+            call.status = str(response.status_code)
+            # Body transfer times vary too much to feed the adaptive timeout
+            if upstream_health.is_failure_status(response.status_code):
+                health.record_failure()
+            else:
+                health.record_success()
+            try:
+                yield response
+            finally:
+                await response_context.__aexit__(None, None, None)
+
+
+async def close() -> None:
+    """Close the shared client and its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _host_semaphores.clear()
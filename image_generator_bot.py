@@ -1,31 +1,44 @@
 import os
+import time
+# Startup time is measured from here, before the heavier imports
+STARTUP_BEGAN = time.perf_counter()
 import logging
 import sys
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-import requests
+from telegram.error import TelegramError
+import logging_setup
+import http_client
+import metrics
+import upstream_health
+import features
+from replicate_jobs import ReplicateJobEngine, BatchQueue
+from speedtest_runner import SpeedTestRunner
+from cache import TTLCache, flush_writes
+from singleflight import SingleFlight
+from youtube_meta import fetch_video_metadata
+import rate_limit
+import state_backend
+from tmdb_client import TMDBClient, TMDBError
+from rdap_client import RDAPClient
+from media import MediaRegistry, send_results
+import audd_client
+from webhook_server import WebhookServer
+from dispatcher import PerChatUpdateProcessor, MAX_CONCURRENT_UPDATES
+import scheduler
+from scheduler import QueueFull
+from rate_limit import rate_limited
+import re
 import urllib.parse
 from datetime import datetime, timedelta
-from collections import defaultdict
-import base64
-from pytube import YouTube
-import re
-from replicate.client import Client
-import replicate
-import json
+import tempfile
+import math
+import signal
+import asyncio
 from typing import Optional, Dict, Any, List
-import speedtest
-from requests_toolbelt.multipart.encoder import MultipartEncoder
-
-# Enable logging with file output
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('bot.log')
-    ]
-)
+
+# Enable logging to stdout and a rotating file, written from a background thread
+logging_setup.configure_logging()
 
 logger = logging.getLogger(__name__)
 
@@ -47,16 +60,19 @@ missing_tokens = [name for name, token in required_tokens.items() if not token]
 if missing_tokens:
     raise ValueError(f"Missing required environment variables: {', '.join(missing_tokens)}")
 
-# Rate limiting
-USER_RATES: Dict[int, list] = defaultdict(list)
+# Shared state for rate limits, quotas and persistent caches (STATE_BACKEND=memory|sqlite|redis)
+state = state_backend.from_env()
+rate_limit.set_backend(state)
+
+# Rate limiting (extra per-command limits via RATE_LIMITS, e.g. "gemma=5/60,song=10/60")
 MAX_REQUESTS_PER_MINUTE = 3
+rate_limit.configure_from_env()
+dalle_limiter = rate_limit.limiter_for("dalle", MAX_REQUESTS_PER_MINUTE, 60)
 MAX_PROMPT_LENGTH = 200
 
 # API URLs
 MUSIC_API_BASE = "https://jiosaavn-api-codyandersan.vercel.app/search/all"
 WHOIS_API_BASE = "https://rdap.org/domain/"
-AUDD_API_URL = "https://api.audd.io/"
-TMDB_API_BASE = "https://api.themoviedb.org/3"
 GEMMA_API_BASE = "https://apilonic.netlify.app/api"
 
 # Film türleri
@@ -81,14 +97,91 @@ MOVIE_GENRES = {
     "western": 37
 }
 
+# Serving mode: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public HTTPS URL Telegram posts updates to
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "1") == "1"
+
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise ValueError("WEBHOOK_URL is required when BOT_MODE=webhook")
+
+# Persistent cache storage from the state backend (None with the memory backend);
+# CACHE_PERSIST=0 keeps caches in memory only with any backend
+CACHE_PERSIST = os.getenv("CACHE_PERSIST", "1") == "1"
+cache_store = state.cache_store if CACHE_PERSIST else None
+
+# Audd.io recognition cache, keyed on file ID and content hash
+recognition_cache = audd_client.RecognitionCache(cache_store)
+
+# TMDB client with response cache (TMDB_PREWARM=1 keeps all genre pages warm)
+tmdb_client = TMDBClient(TMDB_API_KEY)
+TMDB_PREWARM = os.getenv("TMDB_PREWARM", "0") == "1"
+
 # YouTube video info cache
-youtube_cache: Dict[str, Dict[str, Any]] = {}
+YOUTUBE_CACHE_SIZE = int(os.getenv("YOUTUBE_CACHE_SIZE", "5000"))
+YOUTUBE_CACHE_TTL = int(os.getenv("YOUTUBE_CACHE_TTL", str(7 * 24 * 3600)))
+youtube_cache = TTLCache("youtube", max_size=YOUTUBE_CACHE_SIZE, ttl=YOUTUBE_CACHE_TTL, store=cache_store)
 
 # User limits tracking
 UPSCALE_DAILY_LIMIT = 3
 FLUX_DAILY_LIMIT = 3
-user_upscale_counts: Dict[int, Dict[str, int]] = defaultdict(lambda: {"count": 0, "reset_date": ""})
-user_flux_counts: Dict[int, Dict[str, int]] = defaultdict(lambda: {"count": 0, "reset_date": ""})
+
+# Replicate models
+FLUX_MODEL = "lucataco/sdxl-lcm:fbbd475b1084de80c47c35bfe4ae64b964294aa7e237e6537eed938cfd24903d"
+UPSCALE_MODEL = "nightmareai/real-esrgan:f121d640bd286e1fdc67f9799164c1d5be36ff74576ee11c803ae5b665dd46aa"
+
+# file_ids of photos already sent, so Telegram doesn't download them again
+media_registry = MediaRegistry(cache_store)
+
+# DALL-E results by normalized prompt; "/dalle --yeni ..." skips the cache
+DALLE_CACHE_SIZE = int(os.getenv("DALLE_CACHE_SIZE", "2000"))
+DALLE_CACHE_TTL = int(os.getenv("DALLE_CACHE_TTL", str(7 * 24 * 3600)))
+DALLE_FRESH_FLAG = "--yeni"
+dalle_cache = TTLCache("dalle", max_size=DALLE_CACHE_SIZE, ttl=DALLE_CACHE_TTL, store=cache_store)
+
+# Identical concurrent lookups share one upstream request
+youtube_flight = SingleFlight("youtube")
+song_flight = SingleFlight("song")
+dalle_flight = SingleFlight("dalle")
+
+# RDAP client querying registries directly, with a record cache
+rdap_client = RDAPClient(cache_store, fallback_url=WHOIS_API_BASE)
+
+# Shared Replicate job engine
+replicate_engine = ReplicateJobEngine(REPLICATE_API_TOKEN)
+
+# Flux jobs go through a fair-share queue; "/flux x4 ..." asks for 4 images in one prediction
+flux_queue = BatchQueue(replicate_engine, FLUX_MODEL, {
+    "width": 1024,
+    "height": 1024,
+    "num_inference_steps": 4,
+    "guidance_scale": 1.5
+})
+FLUX_BATCH_PATTERN = re.compile(r"^x(\d)$", re.IGNORECASE)
+
+# Separate pools and queues for the expensive commands (SCHEDULER_POOLS overrides them)
+job_scheduler = scheduler.from_env()
+BUSY_MESSAGE = "⚠️ Şu anda çok yoğunuz, lütfen birkaç dakika sonra tekrar deneyin."
+
+# Speed test worker with cached results
+speedtest_runner = SpeedTestRunner()
+
+# Metrics endpoint (METRICS_PORT=0 disables it) and the stats it exports at scrape time
+metrics_server = metrics.MetricsServer() if metrics.METRICS_PORT else None
+metrics.register_cache(youtube_cache)
+metrics.register_cache(dalle_cache)
+metrics.register_stats("media", {}, media_registry.stats)
+metrics.register_cache(tmdb_client.cache)
+metrics.register_stats("rdap", {}, rdap_client.stats)
+metrics.register_stats("recognition", {}, recognition_cache.stats)
+metrics.register_stats("replicate", {}, lambda: {'in_flight': replicate_engine.in_flight})
+metrics.register_stats("flux_queue", {}, flux_queue.stats)
+for flight in (youtube_flight, song_flight, dalle_flight, tmdb_client.flight, rdap_client.flight):
+    metrics.register_stats("singleflight", {'name': flight.name}, flight.stats)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
@@ -97,8 +190,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             f'Merhaba {user_name}! 👋\n\n'
             f'🎨 Resim Komutları:\n'
-            f'1. DALL-E 3 ile resim: /dalle [açıklama]\n'
-            f'2. Flux ile resim: /flux [açıklama]\n'
+            f'1. DALL-E 3 ile resim: /dalle [açıklama] (yeniden üretmek için: /dalle --yeni [açıklama])\n'
+            f'2. Flux ile resim: /flux [açıklama] (4 resim için: /flux x4 [açıklama])\n'
             f'3. Resim iyileştirme: /upscale (resmi yanıtlayarak)\n\n'
             f'🎬 Film Komutları:\n'
             f'1. Film türüne göre öneriler: /genre [tür]\n'
@@ -163,6 +256,7 @@ def extract_video_id(url):
     
     return None
 
+@rate_limited("yt")
 async def youtube_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle YouTube download command."""
     try:
@@ -176,11 +270,11 @@ async def youtube_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Get the URL
         url = context.args[0].strip()
-        logger.info(f"Processing YouTube URL: {url}")  # Debug log
+        logger.debug(f"Processing YouTube URL: {url}")
         
         # Extract video ID
         video_id = extract_video_id(url)
-        logger.info(f"Extracted video ID: {video_id}")  # Debug log
+        logger.debug(f"Extracted video ID: {video_id}")
         
         if not video_id:
             await update.message.reply_text(
@@ -199,37 +293,22 @@ async def youtube_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         try:
-            # Get video info from YouTube
+            # Get video info from YouTube (oEmbed, falling back to the watch page)
             video_url = f"https://www.youtube.com/watch?v={video_id}"
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(video_url, headers=headers, timeout=10)
-            
-            if response.status_code != 200:
-                raise Exception("Video bilgilerine erişilemedi")
-            
-            # Extract video title using regex
-            title_match = re.search(r'<title>(.*?) - YouTube</title>', response.text)
-            if not title_match:
-                raise Exception("Video başlığı alınamadı")
-            
-            title = title_match.group(1)
-            
-            # Extract channel name
-            channel_match = re.search(r'"author":"([^"]+)"', response.text)
-            author = channel_match.group(1) if channel_match else "Bilinmeyen Kanal"
+            metadata = await youtube_flight.do(video_id, lambda: fetch_video_metadata(video_id))
+            title = metadata['title']
+            author = metadata['author']
             
             # Get video thumbnail
             thumbnail = f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg"
             
             # Cache video info
-            youtube_cache[video_id] = {
+            youtube_cache.set(video_id, {
                 'url': video_url,
                 'title': title,
                 'author': author,
                 'thumbnail': thumbnail
-            }
+            })
             
             # Create format selection buttons
             keyboard = [
@@ -245,8 +324,9 @@ async def youtube_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             # Send video info with format selection
-            await update.message.reply_photo(
-                photo=thumbnail,
+            await media_registry.reply_photo(
+                update.message,
+                thumbnail,
                 caption=(
                     f"📹 Video Bilgileri:\n\n"
                     f"📝 Başlık: {title}\n"
@@ -284,7 +364,7 @@ async def youtube_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         # Parse callback data
         action, format_type, video_id = query.data.split('_')
-        video_info = youtube_cache.get(video_id)
+        video_info = await youtube_cache.get_async(video_id)
         
         if not video_info:
             await query.message.reply_text(
@@ -322,6 +402,7 @@ async def youtube_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"YouTube button error: {str(e)}")
         await query.message.reply_text("Bir hata oluştu. Lütfen tekrar deneyin.")
 
+@rate_limited("song")
 async def search_song(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Search for a song and return its details."""
     try:
@@ -348,10 +429,13 @@ async def search_song(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'page': 1,
                 'limit': 5
             }
-            response = requests.get(MUSIC_API_BASE, params=params, timeout=30)
+            # Users searching the same thing at once share one request
+            key = ' '.join(query.lower().split())
+            status_code, data = await song_flight.do(
+                key, lambda: http_client.get_json(MUSIC_API_BASE, params=params, timeout=30)
+            )
             
-            if response.status_code == 200:
-                data = response.json()
+            if status_code == 200:
                 if data.get("status") == "SUCCESS":
                     songs = data.get("data", {}).get("songs", {}).get("results", [])
                     albums = data.get("data", {}).get("albums", {}).get("results", [])
@@ -386,8 +470,9 @@ async def search_song(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     # Send the message with the first song's image if available
                     if songs and songs[0].get('image'):
                         image_url = songs[0]['image'][-1]['link']  # Get highest quality image
-                        await update.message.reply_photo(
-                            photo=image_url,
+                        await media_registry.reply_photo(
+                            update.message,
+                            image_url,
                             caption=message
                         )
                     else:
@@ -402,11 +487,11 @@ async def search_song(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "❌ Müzik API'sine erişilemiyor. Lütfen daha sonra tekrar deneyin."
                 )
                 
-        except requests.Timeout:
+        except http_client.Timeout:
             await update.message.reply_text(
                 "⏰ API yanıt vermedi, lütfen tekrar deneyin."
             )
-        except requests.RequestException as e:
+        except http_client.RequestError as e:
             logger.error(f"Music API request error: {str(e)}")
             await update.message.reply_text(
                 "🔌 Bağlantı hatası oluştu, lütfen tekrar deneyin."
@@ -425,28 +510,57 @@ async def search_song(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Song command error: {str(e)}")
         await update.message.reply_text("Bir hata oluştu. Lütfen tekrar deneyin.")
 
-def check_rate_limit(user_id: int) -> bool:
-    """Check if user has exceeded rate limit."""
-    now = datetime.now()
-    user_requests = USER_RATES[user_id]
-    
-    # Remove requests older than 1 minute
-    user_requests = [req for req in user_requests if now - req < timedelta(minutes=1)]
-    USER_RATES[user_id] = user_requests
-    
-    # Check if user has exceeded limit
-    if len(user_requests) >= MAX_REQUESTS_PER_MINUTE:
+def normalize_prompt(text: str) -> str:
+    """Cache key for a prompt: case and spacing differences don't count."""
+    return " ".join(text.split()).casefold()
+
+async def fetch_dalle_image(prompt: str) -> str:
+    """Ask the DALL-E proxy for one image and return its URL."""
+    # Encode the user's text for the URL
+    encoded_text = urllib.parse.quote(prompt)
+
+    # Make request to the DALL-E 3 API
+    api_url = f"https://prompt.glitchy.workers.dev/gen?key={encoded_text}&t=0.2&f=dalle3&demo=true&count=1&nsfw=true"
+    # Each attempt starts a new generation, so a failure is not retried
+    response = await http_client.get(api_url, timeout=30, retry=False)
+
+    if response.status_code != 200:
+        raise Exception(f"HTTP {response.status_code}")
+    data = response.json()
+    if data.get("status") != 1 or "images" not in data:
+        raise Exception("API yanıtı geçersiz")
+    # Get the image URL from the response
+    return data["images"][0]["imagedemo1"][0]
+
+def dalle_caption(prompt: str) -> str:
+    return (
+        f"🎨 İşte DALL-E 3 ile oluşturduğum resim!\n\n"
+        f"📝 Prompt: {prompt}"
+    )
+
+async def reply_cached_dalle(update: Update, key: str, prompt: str) -> bool:
+    """Answer from the prompt cache; False if there is nothing usable cached."""
+    cached = await dalle_cache.get_async(key)
+    if cached is None:
+        return False
+    try:
+        await media_registry.reply_photo(update.message, cached['url'], caption=dalle_caption(prompt))
+        return True
+    except TelegramError as e:
+        logger.warning(f"Cached DALL-E image could not be sent, generating again: {str(e)}")
+        dalle_cache.delete(key)
         return False
-    
-    # Add new request
-    user_requests.append(now)
-    return True
 
 async def generate_dalle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generate an image using DALL-E 3."""
     try:
+        args = list(context.args or [])
+        fresh = bool(args) and args[0] == DALLE_FRESH_FLAG
+        if fresh:
+            args = args[1:]
+
         # Check if user provided text
-        if not context.args:
+        if not args:
             await update.message.reply_text(
                 "Lütfen bir açıklama girin.\n"
                 "Örnek: /dalle bir adam denizde yüzüyor"
@@ -456,16 +570,8 @@ async def generate_dalle(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Get user ID for rate limiting
         user_id = update.effective_user.id
         
-        # Check rate limit
-        if not check_rate_limit(user_id):
-            remaining_time = 60 - (datetime.now() - USER_RATES[user_id][0]).seconds
-            await update.message.reply_text(
-                f"Çok fazla istek gönderdiniz. Lütfen {remaining_time} saniye bekleyin."
-            )
-            return
-        
         # Get the text after the command
-        user_text = ' '.join(context.args)
+        user_text = ' '.join(args)
         
         # Check prompt length
         if len(user_text) > MAX_PROMPT_LENGTH:
@@ -473,6 +579,20 @@ async def generate_dalle(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"Açıklama çok uzun! Maksimum {MAX_PROMPT_LENGTH} karakter girebilirsiniz."
             )
             return
+
+        # A cached result costs the upstream nothing, so it doesn't count against the limit
+        key = normalize_prompt(user_text)
+        if not fresh and await reply_cached_dalle(update, key, user_text):
+            return
+        
+        # Check rate limit
+        allowed, wait = await rate_limit.allow(dalle_limiter, user_id)
+        if not allowed:
+            remaining_time = math.ceil(wait)
+            await update.message.reply_text(
+                f"Çok fazla istek gönderdiniz. Lütfen {remaining_time} saniye bekleyin."
+            )
+            return
         
         # Send a "processing" message
         processing_message = await update.message.reply_text(
@@ -480,31 +600,15 @@ async def generate_dalle(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         try:
-            # Encode the user's text for the URL
-            encoded_text = urllib.parse.quote(user_text)
-            
-            # Make request to the DALL-E 3 API
-            api_url = f"https://prompt.glitchy.workers.dev/gen?key={encoded_text}&t=0.2&f=dalle3&demo=true&count=1&nsfw=true"
-            response = requests.get(api_url, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("status") == 1 and "images" in data:
-                    # Get the image URL from the response
-                    image_url = data["images"][0]["imagedemo1"][0]
-                    
-                    # Send the image
-                    await update.message.reply_photo(
-                        photo=image_url,
-                        caption=(
-                            f"🎨 İşte DALL-E 3 ile oluşturduğum resim!\n\n"
-                            f"📝 Prompt: {user_text}"
-                        )
-                    )
-                else:
-                    raise Exception("API yanıtı geçersiz")
+            if fresh:
+                image_url = await fetch_dalle_image(user_text)
             else:
-                raise Exception(f"HTTP {response.status_code}")
+                # Identical prompts arriving together share one generation
+                image_url = await dalle_flight.do(key, lambda: fetch_dalle_image(user_text))
+
+            # Send the image
+            await media_registry.reply_photo(update.message, image_url, caption=dalle_caption(user_text))
+            dalle_cache.set(key, {'url': image_url})
                 
         except Exception as e:
             logger.error(f"DALL-E generation error: {str(e)}")
@@ -520,84 +624,116 @@ async def generate_dalle(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"DALL-E command error: {str(e)}")
         await update.message.reply_text("Bir hata oluştu. Lütfen tekrar deneyin.")
 
+def queue_position_updater(message: Any, text: str) -> scheduler.PositionCallback:
+    """Show a job's place in the queue under its processing message, and restore it when the job starts."""
+    async def show(position: int) -> None:
+        if position:
+            await message.edit_text(f"{text}\n👥 Sıradaki yeriniz: {position}")
+        else:
+            await message.edit_text(text)
+    return show
+
+def hours_until_reset() -> int:
+    """Hours left until the daily limits reset at midnight."""
+    reset_time = datetime.now().replace(hour=0, minute=0, second=0) + timedelta(days=1)
+    return int((reset_time - datetime.now()).total_seconds() / 3600)
+
+@features.requires("replicate")
 async def generate_flux(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Generate an image using Flux model with daily limits."""
     try:
         user_id = update.effective_user.id
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        # Reset count if it's a new day
-        if user_flux_counts[user_id]["reset_date"] != today:
-            user_flux_counts[user_id] = {"count": 0, "reset_date": today}
             
         # Check if user has reached daily limit
-        if user_flux_counts[user_id]["count"] >= FLUX_DAILY_LIMIT:
-            remaining_time = datetime.now().replace(hour=0, minute=0, second=0) + timedelta(days=1)
-            hours_left = int((remaining_time - datetime.now()).total_seconds() / 3600)
+        if await state.run(state.quota_remaining, "flux", user_id, FLUX_DAILY_LIMIT) <= 0:
             await update.message.reply_text(
                 f"⚠️ Günlük Flux resim limitinize ulaştınız (3/3)\n"
-                f"🕒 Limitiniz {hours_left} saat sonra yenilenecek."
+                f"🕒 Limitiniz {hours_until_reset()} saat sonra yenilenecek."
             )
             return
 
-        # Get the prompt from message
-        if not context.args:
+        # Get the prompt from message, after an optional "x2".."x4" batch size
+        args = list(context.args or [])
+        outputs = 1
+        match = FLUX_BATCH_PATTERN.match(args[0]) if args else None
+        if match:
+            outputs = max(1, min(int(match.group(1)), flux_queue.max_outputs))
+            args = args[1:]
+
+        if not args:
             await update.message.reply_text("❌ Lütfen bir açıklama girin.\nÖrnek: /flux bir kedi ağaca tırmanıyor")
             return
 
-        prompt = " ".join(context.args)
+        prompt = " ".join(args)
         
         if len(prompt) > MAX_PROMPT_LENGTH:
             await update.message.reply_text(f"❌ Açıklama çok uzun! Maksimum {MAX_PROMPT_LENGTH} karakter girebilirsiniz.")
             return
 
+        # Reserve the quota now so parallel requests can't exceed the limit; a batch counts once
+        if not await state.run(state.reserve_quota, "flux", user_id, FLUX_DAILY_LIMIT):
+            await update.message.reply_text("⚠️ Günlük Flux resim limitinize ulaştınız (3/3)")
+            return
+
         # Send processing message
-        processing_msg = await update.message.reply_text("🔄 Model: SDXL LCM\n⏳ Resim oluşturuluyor...")
+        processing_text = "🔄 Model: SDXL LCM\n⏳ Resim oluşturuluyor..."
+        processing_msg = await update.message.reply_text(processing_text)
 
-        # Initialize Replicate client
-        replicate = Client(api_token=os.getenv("REPLICATE_API_TOKEN"))
-        
-        # Generate image
-        output = replicate.run(
-            "lucataco/sdxl-lcm:fbbd475b1084de80c47c35bfe4ae64b964294aa7e237e6537eed938cfd24903d",
-            input={
-                "prompt": prompt,
-                "width": 1024,
-                "height": 1024,
-                "num_inference_steps": 4,
-                "guidance_scale": 1.5,
-                "num_outputs": 1,
-                "seed": 42
-            }
-        )
+        async def deliver(image_urls: List[str]) -> None:
+            caption = f"🎨 Prompt: {prompt}"
+            if len(image_urls) == 1:
+                # Send the generated image
+                await media_registry.send_photo(
+                    context.bot,
+                    update.effective_chat.id,
+                    image_urls[0],
+                    caption=caption
+                )
+            elif image_urls:
+                # A batch goes out as one album, captioned once
+                await send_results(
+                    update.message,
+                    [(url, caption if i == 0 else "") for i, url in enumerate(image_urls)],
+                    media_registry
+                )
 
-        if output and isinstance(output, list) and len(output) > 0:
-            image_url = output[0]
-            
-            # Send the generated image
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=image_url,
-                caption=f"🎨 Prompt: {prompt}"
-            )
-            
-            # Update user count
-            user_flux_counts[user_id]["count"] += 1
-            remaining = FLUX_DAILY_LIMIT - user_flux_counts[user_id]["count"]
-            
-            await update.message.reply_text(
-                f"ℹ️ Günlük kalan Flux resim hakkınız: {remaining}/3"
-            )
-        else:
-            await update.message.reply_text("❌ Resim oluşturulamadı. Lütfen tekrar deneyin.")
+            if image_urls:
+                remaining = await state.run(state.quota_remaining, "flux", user_id, FLUX_DAILY_LIMIT)
+                await update.message.reply_text(
+                    f"ℹ️ Günlük kalan Flux resim hakkınız: {remaining}/3"
+                )
+            else:
+                await state.run(state.release_quota, "flux", user_id)
+                await update.message.reply_text("❌ Resim oluşturulamadı. Lütfen tekrar deneyin.")
+
+            # Delete processing message
+            await processing_msg.delete()
+
+        async def fail(error: Exception) -> None:
+            await state.run(state.release_quota, "flux", user_id)
+            if isinstance(error, QueueFull):
+                await update.message.reply_text(BUSY_MESSAGE)
+            else:
+                logger.error(f"Flux generation error: {str(error)}")
+                await update.message.reply_text("❌ Bir hata oluştu. Lütfen tekrar deneyin.")
+            await processing_msg.delete()
 
-        # Delete processing message
-        await processing_msg.delete()
+        # Wait for an image slot in the background, then queue the job; it may
+        # share a prediction with the same prompt from other users
+        job_scheduler.submit(
+            "flux",
+            lambda: flux_queue.generate(user_id, prompt, outputs),
+            deliver,
+            fail,
+            on_position=queue_position_updater(processing_msg, processing_text),
+            key=update.effective_chat.id
+        )
 
     except Exception as e:
         logger.error(f"Flux generation error: {str(e)}")
         await update.message.reply_text("❌ Bir hata oluştu. Lütfen tekrar deneyin.")
 
+@rate_limited("whois")
 async def whois_lookup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Look up WHOIS information for a domain."""
     try:
@@ -626,98 +762,92 @@ async def whois_lookup(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         try:
-            # Make request to the RDAP API
-            api_url = f"{WHOIS_API_BASE}{domain}"
-            headers = {
-                'Accept': 'application/rdap+json'
-            }
-            response = requests.get(api_url, headers=headers, timeout=30)
+            # Look up the domain at its registry's RDAP server (cached, shared by concurrent users)
+            try:
+                status_code, data = await rdap_client.lookup(domain)
+            except ValueError as ve:
+                logger.error(f"JSON parsing error: {str(ve)}")
+                await update.message.reply_text(
+                    "❌ API yanıtı geçersiz format içeriyor.\n"
+                    "Lütfen tekrar deneyin."
+                )
+                return
             
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    
-                    # Format the response
-                    message = f"🌐 Domain Bilgileri: {domain}\n\n"
-                    
-                    # Domain Status
-                    if data.get("status"):
-                        statuses = {
-                            "active": "✅ Aktif",
-                            "client delete prohibited": "🔒 Silme Korumalı",
-                            "client transfer prohibited": "🔒 Transfer Korumalı",
-                            "client update prohibited": "🔒 Güncelleme Korumalı",
-                            "server delete prohibited": "🔒 Sunucu Silme Korumalı",
-                            "server transfer prohibited": "🔒 Sunucu Transfer Korumalı",
-                            "server update prohibited": "🔒 Sunucu Güncelleme Korumalı",
-                            "associated": "✅ İlişkili",
-                            "reserved": "⚠️ Rezerve Edilmiş"
-                        }
-                        status_list = [statuses.get(s.lower(), s) for s in data["status"]]
-                        message += f"📊 Durum: {', '.join(status_list)}\n"
-                    
-                    # Events (dates)
-                    if data.get("events"):
-                        for event in data["events"]:
-                            if event.get("eventAction") == "registration":
-                                message += f"📅 Kayıt Tarihi: {event['eventDate']}\n"
-                            elif event.get("eventAction") == "expiration":
-                                message += f"⌛ Bitiş Tarihi: {event['eventDate']}\n"
-                            elif event.get("eventAction") == "last changed":
-                                message += f"🔄 Son Güncelleme: {event['eventDate']}\n"
-                    
-                    # Name Servers
-                    if data.get("nameservers"):
-                        ns_list = [ns.get("ldhName", "") for ns in data["nameservers"]]
-                        message += f"\n🖥️ Name Serverlar:\n"
-                        for ns in ns_list[:3]:  # İlk 3 name server
-                            message += f"  • {ns}\n"
-                    
-                    # Registrar info
-                    if data.get("entities"):
-                        for entity in data["entities"]:
-                            if entity.get("roles"):
-                                if "registrar" in entity["roles"]:
-                                    if entity.get("vcardArray") and len(entity["vcardArray"]) > 1:
-                                        for item in entity["vcardArray"][1]:
-                                            if item[0] == "fn":
-                                                message += f"\n🏢 Kayıt Şirketi: {item[3]}\n"
-                                elif "registrant" in entity["roles"]:
-                                    if entity.get("vcardArray") and len(entity["vcardArray"]) > 1:
-                                        for item in entity["vcardArray"][1]:
-                                            if item[0] == "org":
-                                                message += f"👤 Domain Sahibi: {item[3]}\n"
-                    
-                    # Port43 (WHOIS server)
-                    if data.get("port43"):
-                        message += f"\n🔍 WHOIS Sunucusu: {data['port43']}\n"
-                    
-                    # Send the formatted message
-                    await update.message.reply_text(message)
-                    
-                except ValueError as ve:
-                    logger.error(f"JSON parsing error: {str(ve)}")
-                    await update.message.reply_text(
-                        "❌ API yanıtı geçersiz format içeriyor.\n"
-                        "Lütfen tekrar deneyin."
-                    )
+            if status_code == 200:
+                # Format the response
+                message = f"🌐 Domain Bilgileri: {domain}\n\n"
+                
+                # Domain Status
+                if data.get("status"):
+                    statuses = {
+                        "active": "✅ Aktif",
+                        "client delete prohibited": "🔒 Silme Korumalı",
+                        "client transfer prohibited": "🔒 Transfer Korumalı",
+                        "client update prohibited": "🔒 Güncelleme Korumalı",
+                        "server delete prohibited": "🔒 Sunucu Silme Korumalı",
+                        "server transfer prohibited": "🔒 Sunucu Transfer Korumalı",
+                        "server update prohibited": "🔒 Sunucu Güncelleme Korumalı",
+                        "associated": "✅ İlişkili",
+                        "reserved": "⚠️ Rezerve Edilmiş"
+                    }
+                    status_list = [statuses.get(s.lower(), s) for s in data["status"]]
+                    message += f"📊 Durum: {', '.join(status_list)}\n"
+                
+                # Events (dates)
+                if data.get("events"):
+                    for event in data["events"]:
+                        if event.get("eventAction") == "registration":
+                            message += f"📅 Kayıt Tarihi: {event['eventDate']}\n"
+                        elif event.get("eventAction") == "expiration":
+                            message += f"⌛ Bitiş Tarihi: {event['eventDate']}\n"
+                        elif event.get("eventAction") == "last changed":
+                            message += f"🔄 Son Güncelleme: {event['eventDate']}\n"
+                
+                # Name Servers
+                if data.get("nameservers"):
+                    ns_list = [ns.get("ldhName", "") for ns in data["nameservers"]]
+                    message += f"\n🖥️ Name Serverlar:\n"
+                    for ns in ns_list[:3]:  # İlk 3 name server
+                        message += f"  • {ns}\n"
+                
+                # Registrar info
+                if data.get("entities"):
+                    for entity in data["entities"]:
+                        if entity.get("roles"):
+                            if "registrar" in entity["roles"]:
+                                if entity.get("vcardArray") and len(entity["vcardArray"]) > 1:
+                                    for item in entity["vcardArray"][1]:
+                                        if item[0] == "fn":
+                                            message += f"\n🏢 Kayıt Şirketi: {item[3]}\n"
+                            elif "registrant" in entity["roles"]:
+                                if entity.get("vcardArray") and len(entity["vcardArray"]) > 1:
+                                    for item in entity["vcardArray"][1]:
+                                        if item[0] == "org":
+                                            message += f"👤 Domain Sahibi: {item[3]}\n"
                 
-            elif response.status_code == 404:
+                # Port43 (WHOIS server)
+                if data.get("port43"):
+                    message += f"\n🔍 WHOIS Sunucusu: {data['port43']}\n"
+                
+                # Send the formatted message
+                await update.message.reply_text(message)
+                
+            elif status_code == 404:
                 await update.message.reply_text(
                     f"❌ Domain bulunamadı: {domain}\n"
                     "Domain kayıtlı değil veya yanlış yazılmış olabilir."
                 )
             else:
                 await update.message.reply_text(
-                    f"❌ Domain bilgileri alınamadı (HTTP {response.status_code}).\n"
+                    f"❌ Domain bilgileri alınamadı (HTTP {status_code}).\n"
                     "Lütfen geçerli bir domain adı girin."
                 )
                 
-        except requests.Timeout:
+        except http_client.Timeout:
             await update.message.reply_text(
                 "⏰ API yanıt vermedi, lütfen tekrar deneyin."
             )
-        except requests.RequestException as e:
+        except http_client.RequestError as e:
             logger.error(f"WHOIS API request error: {str(e)}")
             await update.message.reply_text(
                 "🔌 Bağlantı hatası oluştu, lütfen tekrar deneyin."
@@ -736,93 +866,97 @@ async def whois_lookup(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"WHOIS command error: {str(e)}")
         await update.message.reply_text("Bir hata oluştu. Lütfen tekrar deneyin.")
 
+async def send_recognition_result(update: Update, result: Optional[Dict[str, Any]]) -> None:
+    """Reply with a recognized song, or with tips if nothing was found."""
+    if not result:
+        await update.message.reply_text(
+            "❌ Üzgünüm, bu müziği tanıyamadım.\n"
+            "Lütfen daha net bir kayıt göndermeyi deneyin.\n"
+            "İpuçları:\n"
+            "- En az 10 saniye uzunluğunda olmalı\n"
+            "- Arka planda gürültü olmamalı\n"
+            "- Ses kalitesi iyi olmalı"
+        )
+        return
+    
+    # Create response message
+    message = "🎵 Müzik Bulundu!\n\n"
+    message += f"🎤 Sanatçı: {result.get('artist', 'Bilinmiyor')}\n"
+    message += f"🎼 Şarkı: {result.get('title', 'Bilinmiyor')}\n"
+    message += f"💿 Albüm: {result.get('album', 'Bilinmiyor')}\n"
+    
+    # Add release date if available
+    if result.get("release_date"):
+        message += f"📅 Yayın Tarihi: {result['release_date']}\n"
+    
+    # Add streaming links if available
+    message += "\n🎧 Dinleme Linkleri:\n"
+    if result.get("spotify"):
+        spotify = result["spotify"]
+        message += f"Spotify: {spotify.get('external_urls', {}).get('spotify', 'Bulunamadı')}\n"
+    if result.get("apple_music"):
+        apple = result["apple_music"]
+        message += f"Apple Music: {apple.get('url', 'Bulunamadı')}\n"
+    
+    # Add album art if available
+    if result.get("spotify", {}).get("album", {}).get("images"):
+        image_url = result["spotify"]["album"]["images"][0]["url"]
+        await media_registry.reply_photo(
+            update.message,
+            image_url,
+            caption=message
+        )
+    else:
+        await update.message.reply_text(message)
+
 async def recognize_music(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Recognize music from voice message or audio file using Audd.io API."""
     try:
-        # Get the file
-        if update.message.voice:
-            file = await update.message.voice.get_file()
-        elif update.message.audio:
-            file = await update.message.audio.get_file()
-        else:
+        # Get the audio attachment
+        media = update.message.voice or update.message.audio
+        if not media:
             return
         
         # Send processing message
-        processing_message = await update.message.reply_text(
-            "🎵 Müzik tanınıyor, lütfen bekleyin..."
-        )
+        processing_text = "🎵 Müzik tanınıyor, lütfen bekleyin..."
+        processing_message = await update.message.reply_text(processing_text)
         
         try:
-            # Download the file
-            file_bytes = await file.download_as_bytearray()
-            # Convert bytearray to bytes
-            file_data = bytes(file_bytes)
-            
-            # Convert to base64
-            encoded_file = base64.b64encode(file_data).decode('utf-8')
-            
-            # Prepare the request for Audd.io API
-            url = "https://api.audd.io/recognize"
+            # Clips seen before are answered without downloading them
+            cached = await recognition_cache.get_by_file(media.file_unique_id)
+            if cached is not None:
+                await send_recognition_result(update, cached['result'])
+                return
             
-            payload = {
-                "audio": encoded_file,
-                "api_token": AUDD_API_TOKEN,
-                "return": "apple_music,spotify"
-            }
-            
-            headers = {
-                'content-type': 'application/json'
-            }
-            
-            # Make request to Audd.io API
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            # Downloads and Audd.io calls run in the recognition pool
+            async with job_scheduler.slot("voice", queue_position_updater(processing_message, processing_text)):
+                file = await media.get_file()
+                
+                # Spool the file to disk and upload it as a streamed multipart body
+                with tempfile.TemporaryFile() as audio:
+                    size, digest = await audd_client.spool_telegram_file(file, audio)
+                    logger.info(f"Audio file downloaded: {size} bytes")
+                    
+                    # The same audio may arrive as a new upload
+                    cached = await recognition_cache.get_by_content(media.file_unique_id, digest)
+                    if cached is not None:
+                        await send_recognition_result(update, cached['result'])
+                        return
+                    
+                    # Make request to Audd.io API
+                    response = await audd_client.recognize(audio, file.file_path, AUDD_API_TOKEN)
             logger.info(f"Audd.io API Response Status: {response.status_code}")
-            logger.info(f"Audd.io API Response: {response.text}")
-            #a
+            logging_setup.log_payload(logger, "Audd.io API Response", response.text)
+            
             if response.status_code == 200:
                 data = response.json()
                 
-                if data.get("status") == "success" and data.get("result"):
-                    result = data["result"]
-                    
-                    # Create response message
-                    message = "🎵 Müzik Bulundu!\n\n"
-                    message += f"🎤 Sanatçı: {result.get('artist', 'Bilinmiyor')}\n"
-                    message += f"🎼 Şarkı: {result.get('title', 'Bilinmiyor')}\n"
-                    message += f"💿 Albüm: {result.get('album', 'Bilinmiyor')}\n"
-                    
-                    # Add release date if available
-                    if result.get("release_date"):
-                        message += f"📅 Yayın Tarihi: {result['release_date']}\n"
-                    
-                    # Add streaming links if available
-                    message += "\n🎧 Dinleme Linkleri:\n"
-                    if result.get("spotify"):
-                        spotify = result["spotify"]
-                        message += f"Spotify: {spotify.get('external_urls', {}).get('spotify', 'Bulunamadı')}\n"
-                    if result.get("apple_music"):
-                        apple = result["apple_music"]
-                        message += f"Apple Music: {apple.get('url', 'Bulunamadı')}\n"
-                    
-                    # Add album art if available
-                    if result.get("spotify", {}).get("album", {}).get("images"):
-                        image_url = result["spotify"]["album"]["images"][0]["url"]
-                        await update.message.reply_photo(
-                            photo=image_url,
-                            caption=message
-                        )
-                    else:
-                        await update.message.reply_text(message)
-                    
+                if data.get("status") == "success":
+                    result = data.get("result") or None
+                    recognition_cache.set(media.file_unique_id, digest, result)
+                    await send_recognition_result(update, result)
                 else:
-                    await update.message.reply_text(
-                        "❌ Üzgünüm, bu müziği tanıyamadım.\n"
-                        "Lütfen daha net bir kayıt göndermeyi deneyin.\n"
-                        "İpuçları:\n"
-                        "- En az 10 saniye uzunluğunda olmalı\n"
-                        "- Arka planda gürültü olmamalı\n"
-                        "- Ses kalitesi iyi olmalı"
-                    )
+                    await send_recognition_result(update, None)
             else:
                 error_message = "❌ Müzik tanıma servisi şu anda çalışmıyor."
                 if response.status_code == 429:
@@ -836,11 +970,13 @@ async def recognize_music(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "Lütfen daha sonra tekrar deneyin."
                 )
                 
-        except requests.Timeout:
+        except QueueFull:
+            await update.message.reply_text(BUSY_MESSAGE)
+        except http_client.Timeout:
             await update.message.reply_text(
                 "⏰ API yanıt vermedi, lütfen tekrar deneyin."
             )
-        except requests.RequestException as e:
+        except http_client.RequestError as e:
             logger.error(f"Audd.io API request error: {str(e)}")
             await update.message.reply_text(
                 "🔌 Bağlantı hatası oluştu, lütfen tekrar deneyin."
@@ -859,73 +995,46 @@ async def recognize_music(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Music recognition command error: {str(e)}")
         await update.message.reply_text("Bir hata oluştu. Lütfen tekrar deneyin.")
 
+@features.requires("speedtest")
 async def speed_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Perform an internet speed test."""
     try:
+        # Serve a recent result straight from the cache
+        result = speedtest_runner.cached_result()
+        if result:
+            await update.message.reply_text(format_speed_test_result(result))
+            return
+
         # Send initial message
         message = await update.message.reply_text(
             "🔍 İnternet sağlayıcınızın sunucusu bulunuyor..."
         )
+
+        async def on_progress(stage: str, data: Dict[str, Any]) -> None:
+            if stage == "servers":
+                await message.edit_text("📡 Sunucular bulundu, test başlatılıyor...")
+            elif stage == "best_server":
+                best_server = data["server"]
+                await message.edit_text(
+                    f"🎯 Test Sunucusu:\n"
+                    f"📍 {best_server['sponsor']}\n"
+                    f"🏢 {best_server['host']}\n"
+                    f"📌 {best_server['country']}\n\n"
+                    f"⏳ Test başlıyor, lütfen bekleyin..."
+                )
+            elif stage == "download":
+                await message.edit_text("⬇️ İndirme hızı test ediliyor...")
+            elif stage == "upload":
+                await message.edit_text("⬆️ Yükleme hızı test ediliyor...")
+
+        # Run the test in the worker, or join the one already running
+        async with job_scheduler.slot("speedtest", queue_position_updater(message, "🔍 İnternet sağlayıcınızın sunucusu bulunuyor...")):
+            result = await speedtest_runner.run(on_progress)
         
-        # Initialize speedtest
-        st = speedtest.Speedtest()
-        
-        # Get servers from your ISP
-        await message.edit_text("📡 Sunucular bulundu, test başlatılıyor...")
-        servers = []
-        try:
-            servers = st.get_servers()
-            # Try to find server from same ISP
-            isp_servers = [s for s in servers if s['sponsor'] in st.config['client']['isp']]
-            if isp_servers:
-                best_server = st.get_best_server(isp_servers)
-            else:
-                best_server = st.get_best_server(servers)
-        except:
-            best_server = st.get_best_server()
-        
-        # Show selected server
-        await message.edit_text(
-            f"🎯 Test Sunucusu:\n"
-            f"📍 {best_server['sponsor']}\n"
-            f"🏢 {best_server['host']}\n"
-            f"📌 {best_server['country']}\n\n"
-            f"⏳ Test başlıyor, lütfen bekleyin..."
-        )
-        
-        # Test download speed
-        await message.edit_text("⬇️ İndirme hızı test ediliyor...")
-        download_speed = st.download()
-        
-        # Test upload speed
-        await message.edit_text("⬆️ Yükleme hızı test ediliyor...")
-        upload_speed = st.upload()
-        
-        # Get results
-        results = st.results.dict()
-        
-        # Format speeds
-        download_mbps = download_speed / 1_000_000  # Convert to Mbps
-        upload_mbps = upload_speed / 1_000_000  # Convert to Mbps
-        
-        # Format date (Turkish format)
-        test_date = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-        
-        # Format results
-        results_text = (
-            "🌐 İnternet Hız Testi Sonuçları:\n\n"
-            f"⬇️ İndirme: {download_mbps:.2f} Mbps\n"
-            f"⬆️ Yükleme: {upload_mbps:.2f} Mbps\n"
-            f"📡 Ping: {results['ping']:.0f} ms\n\n"
-            f"📍 Sunucu: {best_server['sponsor']}\n"
-            f"🏢 Host: {best_server['host']}\n"
-            f"🌍 Konum: {best_server['country']}\n"
-            f"📍 Mesafe: {best_server['d']:.2f} km\n"
-            f"🕒 Test Tarihi: {test_date}"
-        )
-        
-        await message.edit_text(results_text)
+        await message.edit_text(format_speed_test_result(result))
         
+    except QueueFull:
+        await update.message.reply_text(BUSY_MESSAGE)
     except Exception as e:
         logger.error(f"Speed test error: {str(e)}")
         await update.message.reply_text(
@@ -933,23 +1042,35 @@ async def speed_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Lütfen daha sonra tekrar deneyin."
         )
 
+def format_speed_test_result(result: Dict[str, Any]) -> str:
+    """Format a speed test result as a Turkish message."""
+    best_server = result["server"]
+    # Format date (Turkish format)
+    test_date = result["tested_at"].strftime("%d.%m.%Y %H:%M:%S")
+    
+    return (
+        "🌐 İnternet Hız Testi Sonuçları:\n\n"
+        f"⬇️ İndirme: {result['download_mbps']:.2f} Mbps\n"
+        f"⬆️ Yükleme: {result['upload_mbps']:.2f} Mbps\n"
+        f"📡 Ping: {result['ping']:.0f} ms\n\n"
+        f"📍 Sunucu: {best_server['sponsor']}\n"
+        f"🏢 Host: {best_server['host']}\n"
+        f"🌍 Konum: {best_server['country']}\n"
+        f"📍 Mesafe: {best_server['d']:.2f} km\n"
+        f"🕒 Test Tarihi: {test_date}"
+    )
+
+@features.requires("replicate")
 async def upscale_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle image upscaling requests with daily limits."""
     try:
         user_id = update.effective_user.id
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        # Reset count if it's a new day
-        if user_upscale_counts[user_id]["reset_date"] != today:
-            user_upscale_counts[user_id] = {"count": 0, "reset_date": today}
             
         # Check if user has reached daily limit
-        if user_upscale_counts[user_id]["count"] >= UPSCALE_DAILY_LIMIT:
-            remaining_time = datetime.now().replace(hour=0, minute=0, second=0) + timedelta(days=1)
-            hours_left = int((remaining_time - datetime.now()).total_seconds() / 3600)
+        if await state.run(state.quota_remaining, "upscale", user_id, UPSCALE_DAILY_LIMIT) <= 0:
             await update.message.reply_text(
                 f"⚠️ Günlük iyileştirme limitinize ulaştınız (3/3)\n"
-                f"🕒 Limitiniz {hours_left} saat sonra yenilenecek."
+                f"🕒 Limitiniz {hours_until_reset()} saat sonra yenilenecek."
             )
             return
 
@@ -964,51 +1085,71 @@ async def upscale_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         photo = update.message.reply_to_message.photo[-1]
         
         # Download photo
-        processing_msg = await update.message.reply_text("🔄 Resim iyileştiriliyor...")
+        processing_text = "🔄 Resim iyileştiriliyor..."
+        processing_msg = await update.message.reply_text(processing_text)
         
         file = await context.bot.get_file(photo.file_id)
         file_url = file.file_path
 
-        # Initialize Replicate client
-        replicate = Client(api_token=os.getenv("REPLICATE_API_TOKEN"))
-        
-        # Run Upscale model with verified parameters
-        output = replicate.run(
-            "nightmareai/real-esrgan:f121d640bd286e1fdc67f9799164c1d5be36ff74576ee11c803ae5b665dd46aa",
-            input={
-                "image": file_url,
-                "scale": 2
-            }
-        )
-        
-        if output and isinstance(output, str):
-            enhanced_url = output
-        elif output and isinstance(output, list) and len(output) > 0:
-            enhanced_url = output[0]
-        else:
-            raise Exception("Invalid output format from Replicate API")
+        # Reserve the quota now so parallel requests can't exceed the limit
+        if not await state.run(state.reserve_quota, "upscale", user_id, UPSCALE_DAILY_LIMIT):
+            await processing_msg.delete()
+            await update.message.reply_text("⚠️ Günlük iyileştirme limitinize ulaştınız (3/3)")
+            return
 
-        # Send enhanced image
-        await context.bot.send_photo(
-            chat_id=update.effective_chat.id,
-            photo=enhanced_url,
-            caption="✨ Resim iyileştirildi!\n🔍 4x daha yüksek kalite"
-        )
-        
-        # Update user count
-        user_upscale_counts[user_id]["count"] += 1
-        remaining = UPSCALE_DAILY_LIMIT - user_upscale_counts[user_id]["count"]
-        
-        await update.message.reply_text(
-            f"ℹ️ Günlük kalan iyileştirme hakkınız: {remaining}/3"
+        async def deliver(output: Any) -> None:
+            if output and isinstance(output, str):
+                enhanced_url = output
+            elif output and isinstance(output, list) and len(output) > 0:
+                enhanced_url = output[0]
+            else:
+                raise Exception("Invalid output format from Replicate API")
+
+            # Send enhanced image
+            await media_registry.send_photo(
+                context.bot,
+                update.effective_chat.id,
+                enhanced_url,
+                caption="✨ Resim iyileştirildi!\n🔍 4x daha yüksek kalite"
+            )
+            
+            remaining = await state.run(state.quota_remaining, "upscale", user_id, UPSCALE_DAILY_LIMIT)
+            await update.message.reply_text(
+                f"ℹ️ Günlük kalan iyileştirme hakkınız: {remaining}/3"
+            )
+            
+            await processing_msg.delete()
+
+        async def fail(error: Exception) -> None:
+            await state.run(state.release_quota, "upscale", user_id)
+            if isinstance(error, QueueFull):
+                await update.message.reply_text(BUSY_MESSAGE)
+            else:
+                logger.error(f"Upscale error: {str(error)}")
+                await update.message.reply_text("❌ Bir hata oluştu. Lütfen daha sonra tekrar deneyin.")
+            await processing_msg.delete()
+
+        # Run Upscale model with verified parameters in the background, once an image slot is free
+        job_scheduler.submit(
+            "upscale",
+            lambda: replicate_engine.run(
+                UPSCALE_MODEL,
+                {
+                    "image": file_url,
+                    "scale": 2
+                }
+            ),
+            deliver,
+            fail,
+            on_position=queue_position_updater(processing_msg, processing_text),
+            key=update.effective_chat.id
         )
         
-        await processing_msg.delete()
-        
     except Exception as e:
         logging.error(f"Upscale error: {str(e)}")
         await update.message.reply_text("❌ Bir hata oluştu. Lütfen daha sonra tekrar deneyin.")
 
+@rate_limited("genre")
 async def genre_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Get movie recommendations by genre."""
     try:
@@ -1040,64 +1181,51 @@ async def genre_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         try:
-            # Make request to TMDB API
-            url = f"{TMDB_API_BASE}/discover/movie"
-            params = {
-                'api_key': TMDB_API_KEY,
-                'language': 'tr-TR',
-                'sort_by': 'popularity.desc',
-                'with_genres': MOVIE_GENRES[genre],
-                'page': 1
-            }
-            
-            response = requests.get(url, params=params, timeout=30)
+            # Get the genre page from TMDB (served from cache when fresh)
+            data = await tmdb_client.discover_genre(MOVIE_GENRES[genre])
+            movies = data.get('results', [])[:5]  # Get top 5 movies
             
-            if response.status_code == 200:
-                data = response.json()
-                movies = data.get('results', [])[:5]  # Get top 5 movies
-                
-                if movies:
-                    for movie in movies:
-                        # Get movie details
-                        title = movie.get('title', 'Bilinmiyor')
-                        overview = movie.get('overview', 'Açıklama yok')
-                        release_date = movie.get('release_date', 'Bilinmiyor')
-                        vote_average = movie.get('vote_average', 0)
-                        poster_path = movie.get('poster_path')
-                        
-                        # Create message
-                        message = (
-                            f"🎬 {title}\n\n"
-                            f"📅 Yayın Tarihi: {release_date}\n"
-                            f"⭐ TMDB Puanı: {vote_average}/10\n\n"
-                            f"📝 Özet:\n{overview}\n\n"
-                            f"🎯 Tür: {genre.title()}"
-                        )
-                        
-                        # Send movie info with poster if available
-                        if poster_path:
-                            poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}"
-                            await update.message.reply_photo(
-                                photo=poster_url,
-                                caption=message
-                            )
-                        else:
-                            await update.message.reply_text(message)
-                else:
-                    await update.message.reply_text(
-                        f"❌ {genre.title()} türünde film bulunamadı."
+            if movies:
+                results = []
+                for movie in movies:
+                    # Get movie details
+                    title = movie.get('title', 'Bilinmiyor')
+                    overview = movie.get('overview', 'Açıklama yok')
+                    release_date = movie.get('release_date', 'Bilinmiyor')
+                    vote_average = movie.get('vote_average', 0)
+                    poster_path = movie.get('poster_path')
+                    
+                    # Create message
+                    message = (
+                        f"🎬 {title}\n\n"
+                        f"📅 Yayın Tarihi: {release_date}\n"
+                        f"⭐ TMDB Puanı: {vote_average}/10\n\n"
+                        f"📝 Özet:\n{overview}\n\n"
+                        f"🎯 Tür: {genre.title()}"
                     )
+                    
+                    # Attach the poster if available
+                    poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None
+                    results.append((poster_url, message))
+                
+                # Send all movies as one album
+                await send_results(update.message, results, media_registry)
             else:
                 await update.message.reply_text(
-                    "❌ Film bilgileri alınamadı.\n"
-                    "Lütfen daha sonra tekrar deneyin."
+                    f"❌ {genre.title()} türünde film bulunamadı."
                 )
                 
-        except requests.Timeout:
+        except TMDBError as e:
+            logger.error(f"TMDB API error: {str(e)}")
+            await update.message.reply_text(
+                "❌ Film bilgileri alınamadı.\n"
+                "Lütfen daha sonra tekrar deneyin."
+            )
+        except http_client.Timeout:
             await update.message.reply_text(
                 "⏰ API yanıt vermedi, lütfen tekrar deneyin."
             )
-        except requests.RequestException as e:
+        except http_client.RequestError as e:
             logger.error(f"TMDB API request error: {str(e)}")
             await update.message.reply_text(
                 "🔌 Bağlantı hatası oluştu, lütfen tekrar deneyin."
@@ -1110,6 +1238,7 @@ async def genre_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Genre movies error: {str(e)}")
         await update.message.reply_text("Bir hata oluştu. Lütfen tekrar deneyin.")
 
+@rate_limited("similar")
 async def similar_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Get similar movie recommendations."""
     try:
@@ -1129,95 +1258,81 @@ async def similar_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         try:
-            # First, search for the movie
-            search_url = f"{TMDB_API_BASE}/search/movie"
-            search_params = {
-                'api_key': TMDB_API_KEY,
-                'language': 'tr-TR',
-                'query': movie_name
-            }
+            # First, search for the movie (served from cache when fresh)
+            try:
+                search_data = await tmdb_client.search_movie(movie_name)
+            except TMDBError as e:
+                logger.error(f"TMDB search error: {str(e)}")
+                await update.message.reply_text(
+                    "❌ Film araması yapılamadı.\n"
+                    "Lütfen daha sonra tekrar deneyin."
+                )
+                return
             
-            search_response = requests.get(search_url, params=search_params, timeout=30)
+            movies = search_data.get('results', [])
+            if not movies:
+                await update.message.reply_text(
+                    f"❌ '{movie_name}' filmi bulunamadı.\n"
+                    "Lütfen film adını kontrol edip tekrar deneyin."
+                )
+                return
             
-            if search_response.status_code == 200:
-                search_data = search_response.json()
-                movies = search_data.get('results', [])
-                
-                if movies:
-                    # Get first movie's ID
-                    movie_id = movies[0]['id']
-                    
-                    # Get similar movies
-                    similar_url = f"{TMDB_API_BASE}/movie/{movie_id}/similar"
-                    similar_params = {
-                        'api_key': TMDB_API_KEY,
-                        'language': 'tr-TR'
-                    }
-                    
-                    similar_response = requests.get(similar_url, params=similar_params, timeout=30)
-                    
-                    if similar_response.status_code == 200:
-                        similar_data = similar_response.json()
-                        similar_movies = similar_data.get('results', [])[:5]  # Get top 5 similar movies
-                        
-                        if similar_movies:
-                            # Send original movie info first
-                            original_movie = movies[0]
-                            await update.message.reply_text(
-                                f"🎯 Aranan Film: {original_movie.get('title')}\n"
-                                f"📅 Yayın Tarihi: {original_movie.get('release_date')}\n"
-                                f"⭐ TMDB Puanı: {original_movie.get('vote_average')}/10\n\n"
-                                "🎬 Benzer Filmler:"
-                            )
-                            
-                            # Send similar movies
-                            for movie in similar_movies:
-                                title = movie.get('title', 'Bilinmiyor')
-                                overview = movie.get('overview', 'Açıklama yok')
-                                release_date = movie.get('release_date', 'Bilinmiyor')
-                                vote_average = movie.get('vote_average', 0)
-                                poster_path = movie.get('poster_path')
-                                
-                                message = (
-                                    f"🎬 {title}\n\n"
-                                    f"📅 Yayın Tarihi: {release_date}\n"
-                                    f"⭐ TMDB Puanı: {vote_average}/10\n\n"
-                                    f"📝 Özet:\n{overview}"
-                                )
-                                
-                                if poster_path:
-                                    poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}"
-                                    await update.message.reply_photo(
-                                        photo=poster_url,
-                                        caption=message
-                                    )
-                                else:
-                                    await update.message.reply_text(message)
-                        else:
-                            await update.message.reply_text(
-                                f"❌ '{movie_name}' filmine benzer film bulunamadı."
-                            )
-                    else:
-                        await update.message.reply_text(
-                            "❌ Benzer filmler alınamadı.\n"
-                            "Lütfen daha sonra tekrar deneyin."
-                        )
-                else:
-                    await update.message.reply_text(
-                        f"❌ '{movie_name}' filmi bulunamadı.\n"
-                        "Lütfen film adını kontrol edip tekrar deneyin."
-                    )
-            else:
+            # Get first movie's ID
+            movie_id = movies[0]['id']
+            
+            # Get similar movies
+            try:
+                similar_data = await tmdb_client.similar_movies(movie_id)
+            except TMDBError as e:
+                logger.error(f"TMDB similar error: {str(e)}")
                 await update.message.reply_text(
-                    "❌ Film araması yapılamadı.\n"
+                    "❌ Benzer filmler alınamadı.\n"
                     "Lütfen daha sonra tekrar deneyin."
                 )
+                return
+            
+            similar_movies = similar_data.get('results', [])[:5]  # Get top 5 similar movies
+            if not similar_movies:
+                await update.message.reply_text(
+                    f"❌ '{movie_name}' filmine benzer film bulunamadı."
+                )
+                return
+            
+            # Send original movie info first
+            original_movie = movies[0]
+            await update.message.reply_text(
+                f"🎯 Aranan Film: {original_movie.get('title')}\n"
+                f"📅 Yayın Tarihi: {original_movie.get('release_date')}\n"
+                f"⭐ TMDB Puanı: {original_movie.get('vote_average')}/10\n\n"
+                "🎬 Benzer Filmler:"
+            )
+            
+            # Send similar movies as one album
+            results = []
+            for movie in similar_movies:
+                title = movie.get('title', 'Bilinmiyor')
+                overview = movie.get('overview', 'Açıklama yok')
+                release_date = movie.get('release_date', 'Bilinmiyor')
+                vote_average = movie.get('vote_average', 0)
+                poster_path = movie.get('poster_path')
+                
+                message = (
+                    f"🎬 {title}\n\n"
+                    f"📅 Yayın Tarihi: {release_date}\n"
+                    f"⭐ TMDB Puanı: {vote_average}/10\n\n"
+                    f"📝 Özet:\n{overview}"
+                )
+                
+                poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None
+                results.append((poster_url, message))
+            
+            await send_results(update.message, results, media_registry)
                 
-        except requests.Timeout:
+        except http_client.Timeout:
             await update.message.reply_text(
                 "⏰ API yanıt vermedi, lütfen tekrar deneyin."
             )
-        except requests.RequestException as e:
+        except http_client.RequestError as e:
             logger.error(f"TMDB API request error: {str(e)}")
             await update.message.reply_text(
                 "🔌 Bağlantı hatası oluştu, lütfen tekrar deneyin."
@@ -1230,6 +1345,7 @@ async def similar_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Similar movies error: {str(e)}")
         await update.message.reply_text("Bir hata oluştu. Lütfen tekrar deneyin.")
 
+@rate_limited("gemma")
 async def gemma_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle Gemma AI chat command."""
     try:
@@ -1254,7 +1370,7 @@ async def gemma_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             params = {
                 'prompt': user_text
             }
-            response = requests.get(GEMMA_API_BASE, params=params, timeout=30)
+            response = await http_client.get(GEMMA_API_BASE, params=params, timeout=30, retry=False)
             
             if response.status_code == 200:
                 data = response.json()
@@ -1268,11 +1384,11 @@ async def gemma_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 raise Exception(f"HTTP {response.status_code}")
                 
-        except requests.Timeout:
+        except http_client.Timeout:
             await update.message.reply_text(
                 "⏰ API yanıt vermedi, lütfen tekrar deneyin."
             )
-        except requests.RequestException as e:
+        except http_client.RequestError as e:
             logger.error(f"Gemma API request error: {str(e)}")
             await update.message.reply_text(
                 "🔌 Bağlantı hatası oluştu, lütfen tekrar deneyin."
@@ -1291,11 +1407,89 @@ async def gemma_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Gemma command error: {str(e)}")
         await update.message.reply_text("Bir hata oluştu. Lütfen tekrar deneyin.")
 
+async def post_init(application: Application) -> None:
+    """Start background tasks once the bot is running."""
+    if TMDB_PREWARM:
+        tmdb_client.start_prewarm(MOVIE_GENRES.values())
+    if metrics_server is not None:
+        await metrics_server.start()
+
+async def post_shutdown(application: Application) -> None:
+    """Release shared resources when the bot stops."""
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await tmdb_client.close()
+    logger.info(f"TMDB cache stats: {tmdb_client.cache.stats()}")
+    await job_scheduler.close()
+    logger.info(f"Scheduler stats: {job_scheduler.stats()}")
+    await flux_queue.close()
+    await replicate_engine.close()
+    await http_client.close()
+    speedtest_runner.shutdown()
+    logger.info(f"YouTube cache stats: {youtube_cache.stats()}")
+    logger.info(f"DALL-E cache stats: {dalle_cache.stats()}")
+    logger.info(f"Media registry stats: {media_registry.stats()}")
+    logger.info(f"Recognition cache stats: {recognition_cache.stats()}")
+    logger.info(f"RDAP cache stats: {rdap_client.stats()}")
+    logger.info(f"Upstream health: {upstream_health.snapshot()}")
+    flush_writes()
+    state.close()
+
+async def run_webhook(application: Application) -> None:
+    """Serve updates through the embedded webhook server until a stop signal arrives."""
+    server = WebhookServer(
+        application,
+        host=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET
+    )
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+
+        # Pending updates are kept: Telegram delivers them once the webhook is set
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=False
+        )
+        logger.info(f"Webhook set to {WEBHOOK_URL}")
+
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
 def main():
     """Start the bot."""
     try:
         # Create the Application and pass it your bot's token
-        application = Application.builder().token(TELEGRAM_TOKEN).build()
+        builder = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+        )
+
+        # Process different chats concurrently, keeping each chat's updates in order
+        if MAX_CONCURRENT_UPDATES > 1:
+            builder = builder.concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+
+        application = builder.build()
 
         # Add command handlers
         handlers = [
@@ -1314,22 +1508,48 @@ def main():
             MessageHandler(filters.VOICE | filters.AUDIO, recognize_music)
         ]
 
-        # Add all handlers to the application
+        # Add all handlers to the application, leaving out commands whose backend is missing
+        disabled = set(features.disabled_commands())
+        enabled = []
         for handler in handlers:
+            if isinstance(handler, CommandHandler):
+                if handler.commands & disabled:
+                    logger.warning(f"Disabling /{', /'.join(sorted(handler.commands))}: required package missing")
+                    continue
+                enabled.extend(sorted(handler.commands))
+                name = "/".join(sorted(handler.commands))
+            else:
+                name = handler.callback.__name__
+            handler.callback = metrics.instrument(name, handler.callback)
             application.add_handler(handler)
 
+        # Drop expired quota and rate limit state
+        state.purge()
+
         # Log startup information
         logger.info("Bot configuration:")
         logger.info(f"- Maximum requests per minute: {MAX_REQUESTS_PER_MINUTE}")
+        logger.info(f"- State backend: {state.name}")
         logger.info(f"- Maximum prompt length: {MAX_PROMPT_LENGTH}")
-        logger.info("- Available commands: start, dalle, flux, song, whois, yt, speedtest, upscale, genre, similar, gemma")
+        logger.info(f"- YouTube cache: {YOUTUBE_CACHE_SIZE} entries, {YOUTUBE_CACHE_TTL}s TTL, persistent: {cache_store is not None}")
+        logger.info(f"- Available commands: {', '.join(enabled)}")
         logger.info("- Music recognition enabled: Yes")
+        logger.info(f"- Serving mode: {BOT_MODE}")
+        logger.info(f"- Concurrent updates: {MAX_CONCURRENT_UPDATES} (ordered per chat)")
+        for name, info in features.report().items():
+            status = "loaded" if info['loaded'] else "lazy" if info['available'] else f"unavailable ({info['error']})"
+            logger.info(f"- Feature {name} ({info['module']}): {status}")
+        logger.info(f"- Startup time: {(time.perf_counter() - STARTUP_BEGAN) * 1000:.0f} ms")
         logger.info("Bot started successfully!")
 
+        if BOT_MODE == "webhook":
+            asyncio.run(run_webhook(application))
+            return
+
         # Start the Bot with error handling and increased timeouts
         application.run_polling(
             allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,
+            drop_pending_updates=DROP_PENDING_UPDATES,
             timeout=120,  # Increased timeout
             read_timeout=120,  # Added read timeout
             write_timeout=120,  # Added write timeout
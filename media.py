@@ -0,0 +1,154 @@
+import os
+import logging
+from typing import Optional, List, Tuple, Dict, Any
+
+from telegram import Bot, Message, InputMediaPhoto
+from telegram.error import TelegramError, BadRequest
+
+from cache import TTLCache, SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# Telegram limits
+CAPTION_LIMIT = 1024
+MEDIA_GROUP_MAX = 10
+
+# file_ids of photos already sent, by source URL
+MEDIA_REGISTRY_SIZE = int(os.getenv("MEDIA_REGISTRY_SIZE", "20000"))
+MEDIA_REGISTRY_TTL = int(os.getenv("MEDIA_REGISTRY_TTL", str(30 * 24 * 3600)))
+
+# A result is (photo URL or None, caption)
+Result = Tuple[Optional[str], str]
+
+
+def _truncate(caption: str) -> str:
+    if len(caption) <= CAPTION_LIMIT:
+        return caption
+    return caption[:CAPTION_LIMIT - 1] + "…"
+
+
+class MediaRegistry:
+    """file_ids Telegram assigned to the photos the bot sent, by source URL.
+
+    Sending a photo by URL makes Telegram download it again every time;
+    sending the file_id from an earlier message reuses the copy Telegram
+    already has. A file_id that Telegram no longer accepts is forgotten and
+    the photo is sent by URL again.
+    """
+
+    def __init__(self, store: Optional[SQLiteStore] = None, max_size: int = MEDIA_REGISTRY_SIZE, ttl: float = MEDIA_REGISTRY_TTL):
+        self.cache = TTLCache("file_ids", max_size=max_size, ttl=ttl, store=store)
+        self.reused = 0
+        self.stale = 0
+
+    async def resolve(self, url: str) -> str:
+        """The file_id for a URL if one is known, otherwise the URL."""
+        file_id = await self.cache.get_async(url)
+        if file_id is not None:
+            self.reused += 1
+            return file_id
+        return url
+
+    def remember(self, url: str, message: Optional[Message]) -> None:
+        if message is not None and message.photo:
+            # The largest size; Telegram keeps all sizes under the one photo
+            self.cache.set(url, message.photo[-1].file_id)
+
+    def forget(self, url: str) -> None:
+        self.stale += 1
+        self.cache.delete(url)
+
+    async def reply_photo(self, message: Message, url: str, **kwargs: Any) -> Message:
+        """message.reply_photo, reusing or recording the file_id for the URL."""
+        photo = await self.resolve(url)
+        try:
+            sent = await message.reply_photo(photo=photo, **kwargs)
+        except BadRequest as e:
+            if photo == url:
+                raise
+            logger.warning(f"Stored file_id rejected, sending by URL: {str(e)}")
+            self.forget(url)
+            photo = url
+            sent = await message.reply_photo(photo=url, **kwargs)
+        if photo == url:
+            self.remember(url, sent)
+        return sent
+
+    async def send_photo(self, bot: Bot, chat_id: int, url: str, **kwargs: Any) -> Message:
+        """bot.send_photo, reusing or recording the file_id for the URL."""
+        photo = await self.resolve(url)
+        try:
+            sent = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+        except BadRequest as e:
+            if photo == url:
+                raise
+            logger.warning(f"Stored file_id rejected, sending by URL: {str(e)}")
+            self.forget(url)
+            photo = url
+            sent = await bot.send_photo(chat_id=chat_id, photo=url, **kwargs)
+        if photo == url:
+            self.remember(url, sent)
+        return sent
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.cache.stats(), "reused": self.reused, "stale": self.stale}
+
+
+async def send_results(message: Message, results: List[Result], registry: Optional[MediaRegistry] = None) -> None:
+    """Reply with several results using as few Telegram round trips as possible.
+
+    Consecutive results with a photo are sent together as media group albums;
+    Telegram fetches all the photos of an album in parallel. A result without
+    a photo goes out as text in its place, so the original order is kept. If
+    an album is rejected (e.g. one photo URL is broken), its results are sent
+    one by one so the others still arrive, in order. With a registry, photos
+    sent before go out by file_id.
+    """
+    chunk: List[Result] = []
+    for url, caption in results:
+        if url:
+            chunk.append((url, caption))
+            if len(chunk) == MEDIA_GROUP_MAX:
+                await _send_album(message, chunk, registry)
+                chunk = []
+            continue
+        if chunk:
+            await _send_album(message, chunk, registry)
+            chunk = []
+        await message.reply_text(caption)
+    if chunk:
+        await _send_album(message, chunk, registry)
+
+
+async def _send_album(message: Message, chunk: List[Result], registry: Optional[MediaRegistry] = None) -> None:
+    # An album needs at least two items
+    if len(chunk) == 1:
+        await _send_single(message, chunk[0], registry)
+        return
+    media = [await registry.resolve(url) if registry else url for url, _ in chunk]
+    try:
+        sent = await message.reply_media_group(
+            media=[InputMediaPhoto(media=photo, caption=_truncate(caption)) for photo, (_, caption) in zip(media, chunk)]
+        )
+        if registry is not None:
+            for (url, _), photo, item in zip(chunk, media, sent):
+                if photo == url:
+                    registry.remember(url, item)
+    except TelegramError as e:
+        logger.warning(f"Media group rejected, sending items one by one: {str(e)}")
+        for result in chunk:
+            await _send_single(message, result, registry)
+
+
+async def _send_single(message: Message, result: Result, registry: Optional[MediaRegistry] = None) -> None:
+    url, caption = result
+    try:
+        if registry is not None:
+            await registry.reply_photo(message, url, caption=_truncate(caption))
+        else:
+            await message.reply_photo(photo=url, caption=_truncate(caption))
+    except TelegramError as e:
+        logger.warning(f"Photo could not be sent, falling back to text: {str(e)}")
+        # Album items after the first often have no caption; Telegram rejects empty text
+        if caption:
+            await message.reply_text(caption)
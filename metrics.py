@@ -0,0 +1,262 @@
+import os
+import abc
+import time
+import asyncio
+import logging
+import functools
+import urllib.parse
+from bisect import bisect_left
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+# Metrics endpoint; METRICS_PORT=0 disables it. Give each worker on a host its own port:
+# a worker that finds the port taken runs without the endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+METRICS_PATH = "/metrics"
+
+# Latency buckets in seconds, up to the length of a slow Replicate job
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric(abc.ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Exposition lines for the metric's current values."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Cumulative histogram; observations cost one binary search."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., count above the last bucket], sum
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            bounds = [f'le="{bound}"' for bound in self.buckets] + ['le="+Inf"']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {self._sums[labels]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        # (prefix, labels, stats function) read at scrape time
+        self._stats: List[Tuple[str, Dict[str, str], Callable[[], Dict[str, Any]]]] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def register_stats(self, prefix: str, labels: Dict[str, str], stats: Callable[[], Dict[str, Any]]) -> None:
+        """Export every numeric field of a stats() dict as a gauge named bot_<prefix>_<field>."""
+        self._stats.append((prefix, labels, stats))
+
+    def render(self) -> str:
+        parts = [metric.render() for metric in self._metrics.values()]
+        gauges: Dict[str, List[str]] = {}
+        for prefix, labels, stats in self._stats:
+            try:
+                values = stats()
+            except Exception as e:
+                logger.warning(f"Stats collection for {prefix} failed: {str(e)}")
+                continue
+            label_text = _format_labels(tuple(labels), tuple(labels.values()))
+            for field, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                gauges.setdefault(f"bot_{prefix}_{field}", []).append(f"bot_{prefix}_{field}{label_text} {value}")
+        for name, lines in gauges.items():
+            parts.append("\n".join([f"# TYPE {name} gauge"] + lines))
+        return "\n".join(parts) + "\n"
+
+
+registry = Registry()
+
+handler_duration = registry.add(Histogram(
+    "bot_handler_duration_seconds", "Time spent in update handlers", ("handler",)
+))
+handler_in_flight = registry.add(Gauge(
+    "bot_handler_in_flight", "Handlers currently running", ("handler",)
+))
+handler_errors = registry.add(Counter(
+    "bot_handler_errors_total", "Handlers that raised an exception", ("handler",)
+))
+upstream_duration = registry.add(Histogram(
+    "bot_upstream_duration_seconds", "Latency of outbound API calls", ("upstream",)
+))
+upstream_in_flight = registry.add(Gauge(
+    "bot_upstream_in_flight", "Outbound API calls in progress", ("upstream",)
+))
+upstream_responses = registry.add(Counter(
+    "bot_upstream_responses_total", "Outbound API calls by upstream and status (or error type)", ("upstream", "status")
+))
+
+
+def register_stats(prefix: str, labels: Dict[str, str], stats: Callable[[], Dict[str, Any]]) -> None:
+    registry.register_stats(prefix, labels, stats)
+
+
+def register_cache(cache: Any) -> None:
+    """Export a TTLCache's hits, misses, size and hit ratio."""
+    registry.register_stats("cache", {'cache': cache.name}, cache.stats)
+
+
+def upstream_name(url: str) -> str:
+    return urllib.parse.urlparse(url).netloc or "unknown"
+
+
+class UpstreamTimer:
+    """Context manager timing one outbound call; set `status` before it exits."""
+
+    def __init__(self, upstream: str):
+        self.upstream = upstream
+        self.status: Optional[str] = None
+
+    def __enter__(self) -> "UpstreamTimer":
+        self._started = time.perf_counter()
+        upstream_in_flight.inc(self.upstream)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        upstream_in_flight.dec(self.upstream)
+        upstream_duration.observe(time.perf_counter() - self._started, self.upstream)
+        status = self.status or (exc_type.__name__ if exc_type else "ok")
+        upstream_responses.inc(self.upstream, status)
+
+
+def instrument(name: str, handler: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Wrap a handler coroutine with latency, in-flight and error metrics."""
+    @functools.wraps(handler)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        handler_in_flight.inc(name)
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_in_flight.dec(name)
+            handler_duration.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+class MetricsServer:
+    """Serve the registry in the Prometheus text format on a local port."""
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        """Start listening; a port already taken (e.g. by another worker) only disables the endpoint."""
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            logger.warning(f"Metrics endpoint disabled, cannot listen on {self.host}:{self.port}: {str(e)}")
+            return
+        logger.info(f"Metrics available at http://{self.host}:{self.port}{METRICS_PATH}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            # Skip the headers; the request has no body
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split(" ")
+            if len(parts) >= 2 and parts[0] == "GET" and urllib.parse.urlparse(parts[1]).path == METRICS_PATH:
+                status, body = "200 OK", registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import logging
+import threading
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+QUOTA_DB_PATH = os.getenv("QUOTA_DB_PATH", "bot_quota.db")
+
+
+class QuotaStore:
+    """Daily per-user quotas in SQLite (WAL), shareable by several processes.
+
+    Each (kind, user) has one compact row holding the day it was last used and
+    the count for that day. A row from an earlier day counts as zero, so the
+    daily reset needs no scan. Reservations and refunds are each a single
+    atomic statement, so every process sees a refund at once.
+    """
+
+    def __init__(self, path: str = QUOTA_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS quota ("
+            " kind TEXT NOT NULL,"
+            " user_id INTEGER NOT NULL,"
+            " day INTEGER NOT NULL,"
+            " count INTEGER NOT NULL,"
+            " PRIMARY KEY (kind, user_id)) WITHOUT ROWID"
+        )
+
+    @staticmethod
+    def _today() -> int:
+        return date.today().toordinal()
+
+    def used(self, kind: str, user_id: int) -> int:
+        """Return how many units the user has used today."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT count FROM quota WHERE kind = ? AND user_id = ? AND day = ?",
+                (kind, user_id, self._today())
+            ).fetchone()
+        return row[0] if row else 0
+
+    def remaining(self, kind: str, user_id: int, limit: int) -> int:
+        return max(0, limit - self.used(kind, user_id))
+
+    def reserve(self, kind: str, user_id: int, limit: int) -> bool:
+        """Atomically take one unit of today's quota; False if none is left."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO quota (kind, user_id, day, count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (kind, user_id) DO UPDATE SET "
+                " count = CASE WHEN day = excluded.day THEN count + 1 ELSE 1 END,"
+                " day = excluded.day "
+                "WHERE day != excluded.day OR count < ?",
+                (kind, user_id, self._today(), limit)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, kind: str, user_id: int) -> None:
+        """Give back a unit taken by reserve(), e.g. when the job failed."""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE quota SET count = MAX(count - 1, 0) WHERE kind = ? AND user_id = ? AND day = ?",
+                    (kind, user_id, self._today())
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Quota refund write error: {str(e)}")
+
+    def purge_old(self, keep_days: int = 1) -> None:
+        """Delete rows from earlier days; they no longer affect any quota."""
+        with self._lock:
+            self._conn.execute("DELETE FROM quota WHERE day < ?", (self._today() - keep_days,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
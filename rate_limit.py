@@ -0,0 +1,167 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import functools
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Tuple, Callable, Awaitable, Any
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Idle users evicted per check, keeps eviction cost amortized O(1)
+EVICTIONS_PER_CHECK = 8
+
+
+class RateLimiter:
+    """Sliding-window limiter: at most `limit` calls per `period` seconds per user.
+
+    Each active user costs a fixed-size ring of monotonic timestamps. Users are
+    kept in least-recently-seen order, so idle ones are evicted from the front.
+    """
+
+    # In-memory, cheap enough to check on the event loop
+    blocking = False
+
+    def __init__(self, limit: int, period: float = 60):
+        self.limit = limit
+        self.period = period
+        self._windows: "OrderedDict[int, deque]" = OrderedDict()
+
+    def check(self, user_id: int) -> bool:
+        """Record a call and return False if the user is over the limit."""
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        window = self._windows.get(user_id)
+        if window is None:
+            window = deque(maxlen=self.limit)
+            self._windows[user_id] = window
+        else:
+            self._windows.move_to_end(user_id)
+
+        if len(window) >= self.limit and now - window[0] < self.period:
+            return False
+
+        window.append(now)
+        return True
+
+    def retry_after(self, user_id: int) -> float:
+        """Seconds until the user may call again (0 if allowed now)."""
+        window = self._windows.get(user_id)
+        if not window or len(window) < self.limit:
+            return 0.0
+        return max(0.0, self.period - (time.monotonic() - window[0]))
+
+    def _evict_idle(self, now: float) -> None:
+        for _ in range(EVICTIONS_PER_CHECK):
+            if not self._windows:
+                return
+            user_id, window = next(iter(self._windows.items()))
+            if window and now - window[-1] < self.period:
+                return
+            del self._windows[user_id]
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+
+# Per-command limiters
+_limiters: Dict[str, Any] = {}
+
+# State backend providing shared limiters; None keeps them in-process
+_backend: Any = None
+
+
+def set_backend(backend: Any) -> None:
+    """Create limiters through a state backend so they hold across worker processes.
+
+    Shared backends use their own counter-based limiter; RateLimiter above
+    is only used in-process (no backend, or STATE_BACKEND=memory).
+    """
+    global _backend
+    _backend = backend
+
+
+def _new_limiter(command: str, limit: int, period: float) -> Any:
+    if _backend is not None:
+        return _backend.rate_limiter(command, limit, period)
+    return RateLimiter(limit, period)
+
+
+def limiter_for(command: str, limit: int, period: float = 60) -> Any:
+    """Return the limiter registered for a command, creating it if needed."""
+    limiter = _limiters.get(command)
+    if limiter is None:
+        limiter = _new_limiter(command, limit, period)
+        _limiters[command] = limiter
+    return limiter
+
+
+def get_limiter(command: str) -> Optional[Any]:
+    return _limiters.get(command)
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[int, float]]:
+    """Parse a spec like "gemma=5/60,song=10/60" into {command: (limit, period)}."""
+    limits = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            command, rule = item.split("=", 1)
+            limit, period = rule.split("/", 1)
+            limit, period = int(limit), float(period)
+            if limit < 1 or period <= 0:
+                raise ValueError("limit and period must be positive")
+            limits[command.strip()] = (limit, period)
+        except ValueError:
+            logger.warning(f"Ignoring invalid rate limit rule: {item}")
+    return limits
+
+
+def configure_from_env(variable: str = "RATE_LIMITS") -> None:
+    """Register per-command limits from an environment variable."""
+    for command, (limit, period) in parse_limits(os.getenv(variable, "")).items():
+        _limiters[command] = _new_limiter(command, limit, period)
+        logger.info(f"Rate limit for /{command}: {limit} per {period:.0f}s")
+
+
+def _allow(limiter: Any, user_id: int) -> Tuple[bool, float]:
+    if limiter.check(user_id):
+        return True, 0.0
+    return False, limiter.retry_after(user_id)
+
+
+async def allow(limiter: Any, user_id: int) -> Tuple[bool, float]:
+    """Record a call; return whether it is allowed and, if not, seconds to wait.
+
+    Limiters backed by shared state are checked in a worker thread so their
+    I/O doesn't block the event loop.
+    """
+    if getattr(limiter, "blocking", False):
+        return await asyncio.to_thread(_allow, limiter, user_id)
+    return _allow(limiter, user_id)
+
+
+def rate_limited(command: str) -> Callable:
+    """Decorator applying the command's limiter, if one is configured, to a handler."""
+    def decorator(handler: Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            limiter = _limiters.get(command)
+            if limiter is not None and update.effective_user is not None:
+                allowed, wait = await allow(limiter, update.effective_user.id)
+                if not allowed:
+                    remaining_time = math.ceil(wait)
+                    await update.effective_message.reply_text(
+                        f"Çok fazla istek gönderdiniz. Lütfen {remaining_time} saniye bekleyin."
+                    )
+                    return
+            return await handler(update, context)
+        return wrapper
+    return decorator
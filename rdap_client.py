@@ -0,0 +1,155 @@
+import os
+import re
+import time
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+
+import http_client
+from cache import TTLCache, SQLiteStore
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+RDAP_BOOTSTRAP_URL = "https://data.iana.org/rdap/dns.json"
+# Redirector used when the TLD has no entry in the bootstrap file
+RDAP_FALLBACK_URL = "https://rdap.org/domain/"
+
+# Bootstrap refresh interval; a stale copy is still used if the refresh fails
+RDAP_BOOTSTRAP_REFRESH = int(os.getenv("RDAP_BOOTSTRAP_REFRESH", str(24 * 3600)))
+RDAP_BOOTSTRAP_TTL = 30 * 24 * 3600
+
+# Domain record cache; the TTL comes from the response's Cache-Control within these bounds
+RDAP_CACHE_SIZE = int(os.getenv("RDAP_CACHE_SIZE", "5000"))
+RDAP_CACHE_TTL = int(os.getenv("RDAP_CACHE_TTL", "3600"))
+RDAP_MIN_TTL = 60
+RDAP_MAX_TTL = 24 * 3600
+# Unregistered domains are cached for a shorter time
+RDAP_MISS_TTL = int(os.getenv("RDAP_MISS_TTL", "300"))
+
+RDAP_HEADERS = {
+    'Accept': 'application/rdap+json'
+}
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+
+class RDAPClient:
+    """RDAP domain lookups sent straight to the registry that serves the TLD.
+
+    The IANA bootstrap file maps TLDs to registry RDAP servers; it is kept in
+    the cache (and its store, so restarts reuse it) and refreshed daily.
+    Domain records are cached for as long as the registry allows.
+    """
+
+    def __init__(self, store: Optional[SQLiteStore] = None, fallback_url: str = RDAP_FALLBACK_URL):
+        self.cache = TTLCache("rdap", max_size=RDAP_CACHE_SIZE, ttl=RDAP_CACHE_TTL, store=store)
+        self.flight = SingleFlight("rdap")
+        self._fallback_url = fallback_url
+        self._servers: Dict[str, str] = {}
+        self._bootstrap_at = 0.0
+        self.direct = 0
+        self.fallback = 0
+
+    async def lookup(self, domain: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Return the status code and the RDAP record (None unless 200) for a domain.
+
+        Raises ValueError if the registry answers with invalid JSON.
+        """
+        domain = domain.strip().rstrip(".").lower()
+        cached = await self.cache.get_async(domain)
+        if cached is not None:
+            return cached['status'], cached['data']
+        return await self.flight.do(domain, lambda: self._fetch(domain))
+
+    async def _fetch(self, domain: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+        base_url = await self.server_for(domain)
+        if base_url:
+            self.direct += 1
+            url = f"{base_url}domain/{_ascii(domain)}"
+        else:
+            self.fallback += 1
+            url = f"{self._fallback_url}{domain}"
+
+        response = await http_client.get(url, headers=RDAP_HEADERS, timeout=30)
+        if response.status_code == 200:
+            data = response.json()
+            self.cache.set(domain, {'status': 200, 'data': data}, _ttl(response.headers.get("cache-control", "")))
+            return 200, data
+        if response.status_code == 404:
+            self.cache.set(domain, {'status': 404, 'data': None}, RDAP_MISS_TTL)
+        return response.status_code, None
+
+    async def server_for(self, domain: str) -> Optional[str]:
+        """Base URL of the RDAP server for a domain's TLD, or None if unknown."""
+        await self._ensure_bootstrap()
+        labels = _ascii(domain).split(".")
+        # Longest matching suffix wins
+        for start in range(1, len(labels)):
+            server = self._servers.get(".".join(labels[start:]))
+            if server:
+                return server
+        return None
+
+    async def _ensure_bootstrap(self) -> None:
+        if self._servers and time.time() - self._bootstrap_at < RDAP_BOOTSTRAP_REFRESH:
+            return
+
+        if not self._servers:
+            stored = await self.cache.get_async("bootstrap:dns")
+            if stored is not None:
+                self._load(stored['services'], stored['fetched_at'])
+                if time.time() - self._bootstrap_at < RDAP_BOOTSTRAP_REFRESH:
+                    return
+
+        try:
+            await self.flight.do("bootstrap:dns", self._refresh_bootstrap)
+        except (http_client.RequestError, ValueError, KeyError) as e:
+            # Keep using the copy we have, and try again after a while
+            logger.warning(f"RDAP bootstrap refresh failed: {str(e)}")
+            self._bootstrap_at = time.time() - RDAP_BOOTSTRAP_REFRESH + RDAP_MIN_TTL
+
+    async def _refresh_bootstrap(self) -> None:
+        response = await http_client.get(RDAP_BOOTSTRAP_URL, timeout=30)
+        response.raise_for_status()
+        services = response.json()['services']
+        fetched_at = time.time()
+        self._load(services, fetched_at)
+        self.cache.set("bootstrap:dns", {'services': services, 'fetched_at': fetched_at}, RDAP_BOOTSTRAP_TTL)
+        logger.info(f"RDAP bootstrap loaded: {len(self._servers)} TLDs")
+
+    def _load(self, services: List[List[List[str]]], fetched_at: float) -> None:
+        servers = {}
+        for tlds, urls in services:
+            # Prefer HTTPS servers
+            url = next((u for u in urls if u.startswith("https://")), urls[0] if urls else None)
+            if not url:
+                continue
+            if not url.endswith("/"):
+                url += "/"
+            for tld in tlds:
+                servers[tld.lower()] = url
+        self._servers = servers
+        self._bootstrap_at = fetched_at
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.cache.stats(),
+            "tlds": len(self._servers),
+            "direct": self.direct,
+            "fallback": self.fallback
+        }
+
+
+def _ascii(domain: str) -> str:
+    """Punycode form of an internationalized domain name."""
+    try:
+        return domain.encode("idna").decode("ascii")
+    except UnicodeError:
+        return domain
+
+
+def _ttl(cache_control: str) -> int:
+    match = MAX_AGE_PATTERN.search(cache_control)
+    if not match:
+        return RDAP_CACHE_TTL
+    return max(RDAP_MIN_TTL, min(RDAP_MAX_TTL, int(match.group(1))))
@@ -0,0 +1,253 @@
+import os
+import random
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Optional, Any, Dict, Set, List
+
+import features
+import metrics
+import upstream_health
+
+logger = logging.getLogger(__name__)
+
+# Job engine settings
+REPLICATE_MAX_CONCURRENCY = int(os.getenv("REPLICATE_MAX_CONCURRENCY", "20"))
+REPLICATE_POLL_INTERVAL = float(os.getenv("REPLICATE_POLL_INTERVAL", "1.0"))
+REPLICATE_JOB_TIMEOUT = float(os.getenv("REPLICATE_JOB_TIMEOUT", "300"))
+
+FINISHED_STATUSES = ("succeeded", "failed", "canceled")
+
+# Batch queue settings: outputs per prediction and predictions running at once
+BATCH_MAX_OUTPUTS = int(os.getenv("BATCH_MAX_OUTPUTS", "4"))
+BATCH_MAX_ACTIVE = int(os.getenv("BATCH_MAX_ACTIVE", str(REPLICATE_MAX_CONCURRENCY)))
+
+
+class ReplicateJobEngine:
+    """Run Replicate predictions concurrently without blocking the event loop.
+
+    The replicate package is imported when the first job runs, not at startup.
+    """
+
+    def __init__(
+        self,
+        api_token: Optional[str],
+        max_concurrency: int = REPLICATE_MAX_CONCURRENCY,
+        poll_interval: float = REPLICATE_POLL_INTERVAL,
+        timeout: float = REPLICATE_JOB_TIMEOUT,
+        **client_kwargs: Any
+    ):
+        self._api_token = api_token
+        # Passed on to replicate's Client, e.g. a custom httpx transport
+        self._client_kwargs = client_kwargs
+        self._client: Optional[Any] = None
+        self._max_concurrency = max_concurrency
+        self._poll_interval = poll_interval
+        self._timeout = timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Jobs inside run(), including those waiting for a concurrency slot
+        self.in_flight = 0
+
+    def _get_client(self) -> Any:
+        if self._client is None:
+            replicate = features.load("replicate")
+            self._client = replicate.client.Client(api_token=self._api_token, **self._client_kwargs)
+        return self._client
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphore
+
+    async def run(self, ref: str, input: Dict[str, Any]) -> Any:
+        """Create a prediction for `owner/name:version` and wait for its output."""
+        version_id = ref.split(":", 1)[-1]
+        client = self._get_client()
+        # Fail fast, before queueing for a slot, while Replicate is down
+        health = upstream_health.get("replicate")
+        health.before_call()
+        self.in_flight += 1
+        try:
+            async with self._get_semaphore():
+                with metrics.UpstreamTimer("replicate") as call:
+                    try:
+                        prediction = await client.predictions.async_create(version=version_id, input=input)
+                    except Exception:
+                        health.record_failure()
+                        raise
+                    health.record_success()
+                    logger.info(f"Replicate prediction {prediction.id} created for {ref.split(':')[0]}")
+
+                    loop = asyncio.get_running_loop()
+                    deadline = loop.time() + self._timeout
+                    while prediction.status not in FINISHED_STATUSES:
+                        if loop.time() > deadline:
+                            await client.predictions.async_cancel(prediction.id)
+                            raise asyncio.TimeoutError(f"Prediction {prediction.id} timed out")
+                        await asyncio.sleep(self._poll_interval)
+                        prediction = await client.predictions.async_get(prediction.id)
+                    call.status = prediction.status
+        finally:
+            self.in_flight -= 1
+
+        ModelError = features.load("replicate").exceptions.ModelError
+        if prediction.status == "failed":
+            raise ModelError(prediction.error)
+        if prediction.status == "canceled":
+            raise ModelError(f"Prediction {prediction.id} was canceled")
+        return prediction.output
+
+    async def close(self) -> None:
+        """Close the underlying HTTP client."""
+        if self._client is not None:
+            await self._client._async_client.aclose()
+
+
+class BatchJob:
+    """One user's request for `outputs` images of a prompt."""
+
+    def __init__(self, user_id: int, prompt: str, outputs: int):
+        self.user_id = user_id
+        self.prompt = prompt
+        self.outputs = outputs
+        self.key = " ".join(prompt.split()).casefold()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class BatchQueue:
+    """Fair-share queue that packs image jobs into multi-output predictions.
+
+    Each user has their own queue and users are served round robin, so one
+    user's backlog can't hold everyone else up. A prediction is built from
+    the next user's first job plus queued jobs from any user with the same
+    prompt, up to `max_outputs` images; the outputs are then split between
+    them. Jobs are dispatched as soon as a slot is free; only jobs that
+    arrive together, or wait while `max_active` predictions are running,
+    get the chance to share one.
+    """
+
+    def __init__(
+        self,
+        engine: ReplicateJobEngine,
+        ref: str,
+        base_input: Dict[str, Any],
+        max_outputs: int = BATCH_MAX_OUTPUTS,
+        max_active: int = BATCH_MAX_ACTIVE
+    ):
+        self.engine = engine
+        self.ref = ref
+        self.base_input = base_input
+        self.max_outputs = max_outputs
+        self.max_active = max_active
+        self._queues: "OrderedDict[int, deque[BatchJob]]" = OrderedDict()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.predictions = 0
+        self.jobs = 0
+        self.shared = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def generate(self, user_id: int, prompt: str, outputs: int = 1) -> List[str]:
+        """Queue a job and wait for its image URLs."""
+        job = BatchJob(user_id, prompt, max(1, min(outputs, self.max_outputs)))
+        self._queues.setdefault(user_id, deque()).append(job)
+        self.jobs += 1
+        self._start()
+        self._wakeup.set()
+        return await job.future
+
+    def _start(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._slots = asyncio.Semaphore(self.max_active)
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._queues:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await self._slots.acquire()
+            batch = self._next_batch()
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._predict(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _next_batch(self) -> List[BatchJob]:
+        batch: List[BatchJob] = []
+        total = 0
+        while self._queues and not batch:
+            # Round robin: the user served now moves to the back of the line
+            user_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if not job.future.done():
+                batch.append(job)
+                total = job.outputs
+        if not batch:
+            return batch
+
+        for user_id in list(self._queues):
+            queue = self._queues[user_id]
+            for job in list(queue):
+                if job.key == batch[0].key and total + job.outputs <= self.max_outputs:
+                    queue.remove(job)
+                    batch.append(job)
+                    total += job.outputs
+            if not queue:
+                del self._queues[user_id]
+        return batch
+
+    async def _predict(self, batch: List[BatchJob]) -> None:
+        outputs = sum(job.outputs for job in batch)
+        self.predictions += 1
+        self.shared += len(batch) - 1
+        try:
+            # A random seed, so asking again gives new images
+            output = await self.engine.run(self.ref, {
+                **self.base_input,
+                "prompt": batch[0].prompt,
+                "num_outputs": outputs,
+                "seed": random.randrange(2 ** 31)
+            })
+            urls = list(output) if isinstance(output, list) else []
+            start = 0
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_result(urls[start:start + job.outputs])
+                start += job.outputs
+        except Exception as e:
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """`shared` counts jobs that rode along in another job's prediction."""
+        return {
+            "queued": self.queued,
+            "jobs": self.jobs,
+            "predictions": self.predictions,
+            "shared": self.shared
+        }
+
+    async def close(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        tasks = [task for task in (self._dispatcher, *self._tasks) if task is not None]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,314 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable, AsyncIterator, TypeVar
+
+import metrics
+from dispatcher import released_slot
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Pools for the expensive command classes as "class=concurrency/queue depth";
+# SCHEDULER_POOLS overrides them, e.g. "image=2/20,recognition=8/40".
+# Recognition and speed test jobs wait inside their update, so their queue
+# depths should stay well below the dispatcher's pending update limit.
+DEFAULT_POOLS = "image=8/40,recognition=4/40,speedtest=4/20"
+# Command -> (class, priority); lower priorities are served first within a class.
+# Commands not listed here are cheap and never queue.
+COMMAND_CLASSES = {
+    "flux": ("image", 0),
+    "upscale": ("image", 1),
+    "voice": ("recognition", 0),
+    "speedtest": ("speedtest", 0)
+}
+# Minimum seconds between queue position updates sent to one waiting user
+POSITION_UPDATE_INTERVAL = float(os.getenv("SCHEDULER_POSITION_INTERVAL", "2"))
+
+queued_jobs = metrics.registry.add(metrics.Gauge(
+    "bot_scheduler_queued", "Jobs waiting for a slot, by command class", ("job_class",)
+))
+active_jobs = metrics.registry.add(metrics.Gauge(
+    "bot_scheduler_active", "Jobs holding a slot, by command class", ("job_class",)
+))
+rejected_jobs = metrics.registry.add(metrics.Counter(
+    "bot_scheduler_rejected_total", "Jobs turned away because the queue was full", ("job_class",)
+))
+queue_wait = metrics.registry.add(metrics.Histogram(
+    "bot_scheduler_wait_seconds", "Time jobs spent waiting for a slot", ("job_class",)
+))
+
+# Called with the job's place in the queue (1 = next), and with 0 when it starts
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class QueueFull(Exception):
+    """The command class already has as many jobs waiting as it accepts."""
+
+    def __init__(self, job_class: str, depth: int):
+        super().__init__(f"{job_class} queue is full ({depth} waiting)")
+        self.job_class = job_class
+        self.depth = depth
+
+
+class _Waiter:
+    def __init__(self, future: asyncio.Future, on_position: Optional[PositionCallback]):
+        self.future = future
+        self.on_position = on_position
+        self.position = 0
+        self.notified_at = 0.0
+
+
+class JobClass:
+    """A pool of `concurrency` slots with a priority queue of at most `max_queue` jobs.
+
+    A freed slot is handed straight to the next waiter, so a job arriving
+    later can't take it first.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self._waiting: List[Tuple[int, int, _Waiter]] = []
+        self._order = itertools.count()
+        self._callbacks: set = set()
+        # One delayed announcement for waiters whose update was throttled
+        self._trailing: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, waiter in self._waiting if not waiter.future.done())
+
+    def enqueue(self, priority: int, on_position: Optional[PositionCallback] = None) -> asyncio.Future:
+        """Take a slot or a place in the queue; the future resolves once the slot is ours.
+
+        Raises QueueFull instead of queueing past `max_queue`.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if self.active < self.concurrency and not self.queued:
+            self._take(future)
+            return future
+        depth = self.queued
+        if depth >= self.max_queue:
+            self.rejected += 1
+            rejected_jobs.inc(self.name)
+            raise QueueFull(self.name, depth)
+        heapq.heappush(self._waiting, (priority, next(self._order), _Waiter(future, on_position)))
+        queued_jobs.set(self.name, value=self.queued)
+        self._announce_positions()
+        return future
+
+    def release(self) -> None:
+        self.completed += 1
+        self.active -= 1
+        while self._waiting:
+            _, _, waiter = heapq.heappop(self._waiting)
+            if waiter.future.done():
+                # Gave up while waiting
+                continue
+            self._take(waiter.future)
+            if waiter.position:
+                self._notify(waiter, 0)
+            break
+        queued_jobs.set(self.name, value=self.queued)
+        active_jobs.set(self.name, value=self.active)
+        self._announce_positions()
+
+    def _take(self, future: asyncio.Future) -> None:
+        self.active += 1
+        active_jobs.set(self.name, value=self.active)
+        future.set_result(None)
+
+    def _announce_positions(self) -> None:
+        now = time.monotonic()
+        next_due: Optional[float] = None
+        live = sorted(entry for entry in self._waiting if not entry[2].future.done())
+        for position, (_, _, waiter) in enumerate(live, 1):
+            if waiter.on_position is None or waiter.position == position:
+                continue
+            # Throttled, except for the first announcement
+            due = waiter.notified_at + POSITION_UPDATE_INTERVAL
+            if waiter.position and now < due:
+                next_due = due if next_due is None else min(next_due, due)
+                continue
+            waiter.notified_at = now
+            self._notify(waiter, position)
+
+        # Otherwise a throttled waiter keeps its stale position until the queue moves again
+        if next_due is not None and self._trailing is None:
+            self._trailing = asyncio.get_running_loop().call_later(next_due - now, self._announce_trailing)
+
+    def _announce_trailing(self) -> None:
+        self._trailing = None
+        self._announce_positions()
+
+    def _notify(self, waiter: _Waiter, position: int) -> None:
+        waiter.position = position
+        task = asyncio.create_task(self._call(waiter.on_position, position))
+        self._callbacks.add(task)
+        task.add_done_callback(self._callbacks.discard)
+
+    async def _call(self, callback: PositionCallback, position: int) -> None:
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.warning(f"Queue position update failed ({self.name}): {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+
+class Scheduler:
+    """Concurrency pools and priority queues for the expensive commands.
+
+    Each command class gets its own pool, so a burst of one kind of job
+    only queues behind itself. Cheap commands are not scheduled at all.
+    While a job waits, the update's dispatcher slot is given back, so
+    waiting jobs don't hold up other chats.
+
+    Background jobs submitted with the same key (a chat) run one after
+    another and deliver in order. They do not hold up the chat's other
+    updates, though: a cheap command sent after a background job can be
+    answered before the job's result arrives.
+    """
+
+    def __init__(self, pools: Dict[str, Tuple[int, int]], commands: Dict[str, Tuple[str, int]] = COMMAND_CLASSES):
+        self.classes = {name: JobClass(name, concurrency, depth) for name, (concurrency, depth) in pools.items()}
+        self.commands = commands
+        self._tasks: set = set()
+        # Last background job submitted per key, which the next one waits for
+        self._chains: Dict[Any, asyncio.Task] = {}
+
+    def class_for(self, command: str) -> Optional[JobClass]:
+        job_class, _ = self.commands.get(command, (None, 0))
+        return self.classes.get(job_class) if job_class else None
+
+    @asynccontextmanager
+    async def slot(self, command: str, on_position: Optional[PositionCallback] = None) -> AsyncIterator[None]:
+        """Hold a slot of the command's class for the duration of the block.
+
+        Raises QueueFull if the class has no room left in its queue.
+        """
+        job_class = self.class_for(command)
+        if job_class is None:
+            yield
+            return
+
+        _, priority = self.commands[command]
+        started = time.perf_counter()
+        future = job_class.enqueue(priority, on_position)
+        if not future.done():
+            async with released_slot():
+                try:
+                    await future
+                except asyncio.CancelledError:
+                    # The slot may have been handed over just as we gave up
+                    if future.done() and not future.cancelled():
+                        job_class.release()
+                    raise
+        queue_wait.observe(time.perf_counter() - started, job_class.name)
+        try:
+            yield
+        finally:
+            job_class.release()
+
+    def submit(
+        self,
+        command: str,
+        run: Callable[[], Awaitable[T]],
+        on_result: Callable[[T], Awaitable[None]],
+        on_error: Callable[[Exception], Awaitable[None]],
+        on_position: Optional[PositionCallback] = None,
+        key: Any = None
+    ) -> asyncio.Task:
+        """Run a job in the background once it has a slot, and hand its result to a callback.
+
+        The slot is freed before `on_result` runs. A full queue is reported
+        to `on_error` as QueueFull. A job with a key starts only after the
+        previous job with that key has delivered.
+        """
+        previous = self._chains.get(key) if key is not None else None
+        task = asyncio.create_task(self._deliver(command, run, on_result, on_error, on_position, previous))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if key is not None:
+            self._chains[key] = task
+            task.add_done_callback(lambda done: self._forget_chain(key, done))
+        return task
+
+    def _forget_chain(self, key: Any, task: asyncio.Task) -> None:
+        if self._chains.get(key) is task:
+            del self._chains[key]
+
+    async def _deliver(
+        self,
+        command: str,
+        run: Callable[[], Awaitable[T]],
+        on_result: Callable[[T], Awaitable[None]],
+        on_error: Callable[[Exception], Awaitable[None]],
+        on_position: Optional[PositionCallback],
+        previous: Optional[asyncio.Task] = None
+    ) -> None:
+        if previous is not None:
+            # Delivers after the same key's earlier job, however that one ended
+            await asyncio.wait([previous])
+        try:
+            async with self.slot(command, on_position):
+                result = await run()
+            await on_result(result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            try:
+                await on_error(e)
+            except Exception as callback_error:
+                logger.error(f"Scheduled job error callback failed: {str(callback_error)}")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [job_class.stats() for job_class in self.classes.values()]
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def parse_pools(spec: str) -> Dict[str, Tuple[int, int]]:
+    """Parse a spec like "image=8/40,speedtest=4/20" into {class: (concurrency, queue depth)}."""
+    pools = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            name, rule = item.split("=", 1)
+            concurrency, depth = rule.split("/", 1)
+            pools[name.strip()] = (max(1, int(concurrency)), max(0, int(depth)))
+        except ValueError:
+            logger.warning(f"Ignoring invalid scheduler pool rule: {item}")
+    return pools
+
+
+def from_env(variable: str = "SCHEDULER_POOLS") -> Scheduler:
+    """Scheduler with the default pools, overridden by an environment variable."""
+    pools = parse_pools(DEFAULT_POOLS)
+    pools.update(parse_pools(os.getenv(variable, "")))
+    return Scheduler(pools)
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from typing import Dict, Any, Hashable, Callable, Awaitable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Run one call per key at a time; concurrent callers with the same key share it.
+
+    The first caller starts the call as a task and later callers await the
+    same task, getting the same result or exception. The task is shielded,
+    so a caller giving up does not cancel it for the others. The key is
+    forgotten as soon as the call finishes; caching results is left to the
+    caller.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.joined = 0
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(call())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+            self.started += 1
+        else:
+            self.joined += 1
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # Mark the exception as retrieved in case every caller gave up
+        if not future.cancelled():
+            future.exception()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, Any]:
+        """`joined` counts upstream calls saved by sharing."""
+        return {
+            "name": self.name,
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "joined": self.joined
+        }
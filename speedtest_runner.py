@@ -0,0 +1,121 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+
+import features
+
+logger = logging.getLogger(__name__)
+
+# Cache lifetimes in seconds
+SPEEDTEST_RESULT_TTL = float(os.getenv("SPEEDTEST_RESULT_TTL", "300"))
+SPEEDTEST_SERVERS_TTL = float(os.getenv("SPEEDTEST_SERVERS_TTL", "3600"))
+
+ProgressCallback = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+class SpeedTestRunner:
+    """Run speed tests in a worker thread, one at a time, sharing the result."""
+
+    def __init__(self, result_ttl: float = SPEEDTEST_RESULT_TTL, servers_ttl: float = SPEEDTEST_SERVERS_TTL):
+        self._result_ttl = result_ttl
+        self._servers_ttl = servers_ttl
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speedtest")
+        self._servers: List[Dict[str, Any]] = []
+        self._servers_at = 0.0
+        self._result: Optional[Dict[str, Any]] = None
+        self._result_at = 0.0
+        self._in_flight: Optional[asyncio.Task] = None
+        self._listeners: List[ProgressCallback] = []
+
+    def cached_result(self) -> Optional[Dict[str, Any]]:
+        """Return the latest result if it is still fresh."""
+        if self._result and time.monotonic() - self._result_at < self._result_ttl:
+            return self._result
+        return None
+
+    async def run(self, on_progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+        """Return a fresh result, joining the test in flight if there is one."""
+        result = self.cached_result()
+        if result:
+            return result
+
+        if on_progress:
+            self._listeners.append(on_progress)
+        try:
+            if self._in_flight is None or self._in_flight.done():
+                self._in_flight = asyncio.create_task(self._run_in_executor())
+            return await asyncio.shield(self._in_flight)
+        finally:
+            if on_progress in self._listeners:
+                self._listeners.remove(on_progress)
+
+    async def _run_in_executor(self) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+
+        def notify(stage: str, data: Dict[str, Any]) -> None:
+            # Called from the worker thread
+            loop.call_soon_threadsafe(self._broadcast, stage, data)
+
+        result = await loop.run_in_executor(self._executor, self._run_blocking, notify)
+        self._result = result
+        self._result_at = time.monotonic()
+        return result
+
+    def _broadcast(self, stage: str, data: Dict[str, Any]) -> None:
+        for listener in list(self._listeners):
+            asyncio.ensure_future(self._safe_notify(listener, stage, data))
+
+    @staticmethod
+    async def _safe_notify(listener: ProgressCallback, stage: str, data: Dict[str, Any]) -> None:
+        try:
+            await listener(stage, data)
+        except Exception as e:
+            logger.warning(f"Speed test progress update failed: {str(e)}")
+
+    def _get_servers(self, st: Any) -> List[Dict[str, Any]]:
+        """Return candidate servers, preferring the client's ISP, using the cache."""
+        if self._servers and time.monotonic() - self._servers_at < self._servers_ttl:
+            return self._servers
+
+        st.get_servers()
+        servers = [server for group in st.servers.values() for server in group]
+        isp = st.config['client']['isp']
+        isp_servers = [s for s in servers if s['sponsor'] in isp]
+        self._servers = isp_servers or st.get_closest_servers()
+        self._servers_at = time.monotonic()
+        return self._servers
+
+    def _run_blocking(self, notify: Callable[[str, Dict[str, Any]], None]) -> Dict[str, Any]:
+        st = features.load("speedtest").Speedtest()
+
+        try:
+            servers = self._get_servers(st)
+            notify("servers", {"count": len(servers)})
+            best_server = st.get_best_server(servers)
+        except Exception as e:
+            logger.warning(f"Speed test server selection failed, using default: {str(e)}")
+            best_server = st.get_best_server()
+        notify("best_server", {"server": best_server})
+
+        notify("download", {})
+        download_speed = st.download()
+
+        notify("upload", {})
+        upload_speed = st.upload()
+
+        results = st.results.dict()
+        return {
+            "download_mbps": download_speed / 1_000_000,
+            "upload_mbps": upload_speed / 1_000_000,
+            "ping": results['ping'],
+            "server": best_server,
+            "tested_at": datetime.now()
+        }
+
+    def shutdown(self) -> None:
+        """Stop the worker thread."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
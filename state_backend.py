@@ -0,0 +1,337 @@
+import os
+import abc
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from datetime import date
+from typing import Optional, Dict, Any, Tuple, Type, Callable, TypeVar
+
+from cache import SQLiteStore, CACHE_DB_PATH, store_errors
+from quota_store import QuotaStore, QUOTA_DB_PATH
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Where shared state lives: "memory" (single process), "sqlite" (processes on
+# one host) or "redis" (any number of hosts; needs the optional redis package)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "imagebot:")
+
+# Quota counters outlive their day by this long
+QUOTA_KEY_TTL = 2 * 24 * 3600
+# Purge expired counters every this many increments
+COUNTER_PURGE_INTERVAL = 1000
+
+
+class StateBackend(abc.ABC):
+    """Shared state used by rate limits, daily quotas and persistent caches.
+
+    Subclasses provide a cache store (or None for memory-only caches) and
+    atomic counters with expiry; quotas and cross-process rate limits are
+    built on those counters unless a subclass has a better native option.
+    """
+
+    name = "base"
+    shared = False
+    cache_store: Any = None
+
+    @abc.abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: float = 60) -> int:
+        """Atomically add to a counter and return the new value."""
+
+    @abc.abstractmethod
+    def get_counter(self, key: str) -> int:
+        """Return a counter's value, 0 if it is missing or expired."""
+
+    @staticmethod
+    def _quota_key(kind: str, user_id: int) -> str:
+        return f"quota:{kind}:{user_id}:{date.today().toordinal()}"
+
+    def reserve_quota(self, kind: str, user_id: int, limit: int) -> bool:
+        """Take one unit of today's quota; False if none is left."""
+        key = self._quota_key(kind, user_id)
+        if self.incr(key, 1, QUOTA_KEY_TTL) > limit:
+            self.incr(key, -1, QUOTA_KEY_TTL)
+            return False
+        return True
+
+    def release_quota(self, kind: str, user_id: int) -> None:
+        key = self._quota_key(kind, user_id)
+        if self.get_counter(key) > 0:
+            self.incr(key, -1, QUOTA_KEY_TTL)
+
+    def quota_used(self, kind: str, user_id: int) -> int:
+        return self.get_counter(self._quota_key(kind, user_id))
+
+    def quota_remaining(self, kind: str, user_id: int, limit: int) -> int:
+        return max(0, limit - self.quota_used(kind, user_id))
+
+    async def run(self, function: Callable[..., T], *args: Any) -> T:
+        """Call one of the backend's methods from async code, in a worker thread if it does I/O."""
+        if self.shared:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    def rate_limiter(self, command: str, limit: int, period: float = 60) -> Any:
+        """Return a limiter with check()/retry_after() shared through this backend."""
+        return CounterRateLimiter(self, command, limit, period)
+
+    def purge(self) -> None:
+        """Drop expired state that the backend does not expire on its own."""
+
+    def close(self) -> None:
+        pass
+
+
+class CounterRateLimiter:
+    """Sliding-window rate limiter built on two fixed-window counters.
+
+    The previous window's count is weighted by how much of it still overlaps
+    the sliding window, which approximates a true sliding log closely while
+    needing only atomic increments from the backend.
+    """
+
+    # Each check is a round trip to the backend, so callers run it in a thread
+    blocking = True
+
+    def __init__(self, backend: StateBackend, command: str, limit: int, period: float = 60):
+        self.backend = backend
+        self.command = command
+        self.limit = limit
+        self.period = period
+
+    def _window(self, user_id: int) -> Tuple[str, str, float]:
+        now = time.time()
+        window = int(now // self.period)
+        prefix = f"rate:{self.command}:{user_id}"
+        return f"{prefix}:{window}", f"{prefix}:{window - 1}", now - window * self.period
+
+    def check(self, user_id: int) -> bool:
+        key, previous_key, elapsed = self._window(user_id)
+        current = self.backend.incr(key, 1, self.period * 2)
+        previous = self.backend.get_counter(previous_key)
+        if previous * (1 - elapsed / self.period) + current > self.limit:
+            self.backend.incr(key, -1, self.period * 2)
+            return False
+        return True
+
+    def retry_after(self, user_id: int) -> float:
+        """Seconds until previous * (1 - elapsed / period) + current + 1 <= limit."""
+        key, previous_key, elapsed = self._window(user_id)
+        current = self.backend.get_counter(key)
+        previous = self.backend.get_counter(previous_key)
+        headroom = self.limit - current - 1
+        if headroom >= 0:
+            if previous * (1 - elapsed / self.period) <= headroom:
+                return 0.0
+            # The previous window's weight shrinks as the sliding window moves on
+            return self.period * (1 - headroom / previous) - elapsed
+        # Not before the next window, where this window's count is the weighted one
+        return self.period - elapsed + self.period * (1 - (self.limit - 1) / max(current, 1))
+
+
+class MemoryBackend(StateBackend):
+    """Process-local state; nothing survives a restart or is seen by other workers."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._counters: Dict[str, Tuple[int, float]] = {}
+        self._increments = 0
+
+    def incr(self, key: str, amount: int = 1, ttl: float = 60) -> int:
+        now = time.time()
+        value, expires_at = self._counters.get(key, (0, 0.0))
+        if expires_at <= now:
+            value, expires_at = 0, now + ttl
+        value += amount
+        self._counters[key] = (value, expires_at)
+
+        self._increments += 1
+        if self._increments % COUNTER_PURGE_INTERVAL == 0:
+            self.purge()
+        return value
+
+    def get_counter(self, key: str) -> int:
+        value, expires_at = self._counters.get(key, (0, 0.0))
+        return value if expires_at > time.time() else 0
+
+    def rate_limiter(self, command: str, limit: int, period: float = 60) -> RateLimiter:
+        # The exact in-process limiter is cheaper when nothing is shared
+        return RateLimiter(limit, period)
+
+    def purge(self) -> None:
+        now = time.time()
+        for key in [key for key, (_, expires_at) in self._counters.items() if expires_at <= now]:
+            del self._counters[key]
+
+
+class SQLiteBackend(StateBackend):
+    """State in SQLite files in WAL mode, shared by worker processes on one host."""
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, cache_path: str = CACHE_DB_PATH, quota_path: str = QUOTA_DB_PATH):
+        self.cache_store = SQLiteStore(cache_path)
+        self.quotas = QuotaStore(quota_path)
+        self._lock = threading.Lock()
+        self._increments = 0
+        self._conn = sqlite3.connect(cache_path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            " key TEXT PRIMARY KEY,"
+            " value INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL) WITHOUT ROWID"
+        )
+
+    def incr(self, key: str, amount: int = 1, ttl: float = 60) -> int:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                " value = CASE WHEN expires_at > ? THEN value + excluded.value ELSE excluded.value END,"
+                " expires_at = CASE WHEN expires_at > ? THEN expires_at ELSE excluded.expires_at END "
+                "RETURNING value",
+                (key, amount, now + ttl, now, now)
+            ).fetchone()
+            self._increments += 1
+            if self._increments % COUNTER_PURGE_INTERVAL == 0:
+                self._conn.execute("DELETE FROM counters WHERE expires_at <= ?", (now,))
+        return row[0]
+
+    def get_counter(self, key: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM counters WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        return row[0] if row else 0
+
+    # Quotas use the compact one-row-per-user QuotaStore
+    def reserve_quota(self, kind: str, user_id: int, limit: int) -> bool:
+        return self.quotas.reserve(kind, user_id, limit)
+
+    def release_quota(self, kind: str, user_id: int) -> None:
+        self.quotas.release(kind, user_id)
+
+    def quota_used(self, kind: str, user_id: int) -> int:
+        return self.quotas.used(kind, user_id)
+
+    def purge(self) -> None:
+        self.quotas.purge_old()
+        with self._lock:
+            self._conn.execute("DELETE FROM counters WHERE expires_at <= ?", (time.time(),))
+
+    def close(self) -> None:
+        self.cache_store.close()
+        self.quotas.close()
+        with self._lock:
+            self._conn.close()
+
+
+def _redis_errors() -> Tuple[Type[BaseException], ...]:
+    try:
+        from redis.exceptions import RedisError
+    except ImportError:
+        return (OSError,)
+    return (RedisError, OSError)
+
+
+class RedisStore:
+    """Cache store with the SQLiteStore interface, kept in Redis.
+
+    Errors from the client are raised as StoreError.
+    """
+
+    def __init__(self, client: Any, prefix: str = REDIS_PREFIX):
+        self._client = client
+        self._prefix = prefix
+        self._errors = _redis_errors()
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self._prefix}cache:{namespace}:{key}"
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        with store_errors(*self._errors):
+            pipe = self._client.pipeline()
+            pipe.get(self._key(namespace, key))
+            pipe.pttl(self._key(namespace, key))
+            value, ttl_ms = pipe.execute()
+        if value is None:
+            return None
+        expires_at = time.time() + ttl_ms / 1000 if ttl_ms and ttl_ms > 0 else time.time() + 3600
+        return json.loads(value), expires_at
+
+    def set(self, namespace: str, key: str, value: Any, expires_at: float) -> None:
+        ttl_ms = int((expires_at - time.time()) * 1000)
+        if ttl_ms > 0:
+            with store_errors(*self._errors):
+                self._client.set(self._key(namespace, key), json.dumps(value), px=ttl_ms)
+
+    def delete(self, namespace: str, key: str) -> None:
+        with store_errors(*self._errors):
+            self._client.delete(self._key(namespace, key))
+
+    def purge(self, namespace: str, max_size: int) -> None:
+        # Redis expires keys itself; size is bounded by the server's maxmemory policy
+        pass
+
+    def clear(self, namespace: str) -> None:
+        with store_errors(*self._errors):
+            for key in self._client.scan_iter(match=self._key(namespace, "*")):
+                self._client.delete(key)
+
+    def close(self) -> None:
+        pass
+
+
+class RedisBackend(StateBackend):
+    """State in a Redis-compatible server, shared by workers on any number of hosts."""
+
+    name = "redis"
+    shared = True
+
+    def __init__(self, client: Any = None, url: str = REDIS_URL, prefix: str = REDIS_PREFIX):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._client = client
+        self._prefix = prefix
+        self.cache_store = RedisStore(client, prefix)
+
+    def incr(self, key: str, amount: int = 1, ttl: float = 60) -> int:
+        full_key = f"{self._prefix}{key}"
+        pipe = self._client.pipeline()
+        # Creates the key with its expiry only if it does not exist yet
+        pipe.set(full_key, 0, ex=max(1, int(ttl)), nx=True)
+        pipe.incrby(full_key, amount)
+        _, value = pipe.execute()
+        return int(value)
+
+    def get_counter(self, key: str) -> int:
+        value = self._client.get(f"{self._prefix}{key}")
+        return int(value) if value is not None else 0
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def from_env() -> StateBackend:
+    """Create the backend selected by STATE_BACKEND."""
+    if STATE_BACKEND == "memory":
+        return MemoryBackend()
+    if STATE_BACKEND == "redis":
+        return RedisBackend()
+    if STATE_BACKEND != "sqlite":
+        raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND}")
+    return SQLiteBackend()
@@ -0,0 +1,90 @@
+import asyncio
+
+import cache
+from cache import TTLCache, SQLiteStore, StoreError
+
+
+class BrokenStore:
+    """A store whose backend is down."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def _fail(self, *args):
+        self.calls += 1
+        raise StoreError("connection refused")
+
+    get = set = delete = purge = clear = _fail
+
+
+def test_store_errors_count_as_misses():
+    store = BrokenStore()
+    ttl_cache = TTLCache("test", store=store)
+    assert ttl_cache.get("missing", "default") == "default"
+    assert asyncio.run(ttl_cache.get_async("missing")) is None
+
+    ttl_cache.set("key", "value")
+    ttl_cache.delete("key")
+    ttl_cache.clear()
+    cache.flush_writes()
+    assert store.calls == 5
+    assert ttl_cache.misses == 2
+
+
+def test_sqlite_errors_are_store_errors(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.db"))
+    store.close()
+    try:
+        store.get("test", "key")
+    except StoreError:
+        pass
+    else:
+        raise AssertionError("expected StoreError")
+
+
+def test_lru_eviction_and_stats():
+    ttl_cache = TTLCache("test", max_size=2)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    assert ttl_cache.get("a") == 1
+    ttl_cache.set("c", 3)
+
+    # "b" was the least recently used
+    assert ttl_cache.get("b") is None
+    assert ttl_cache.get("a") == 1
+    assert ttl_cache.get("c") == 3
+    stats = ttl_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (3, 1, 1, 2)
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    ttl_cache = TTLCache("test", ttl=10)
+    ttl_cache.set("short", 1, ttl=1)
+    ttl_cache.set("long", 2)
+
+    now[0] += 5
+    assert ttl_cache.get("short") is None
+    assert ttl_cache.get("long") == 2
+    assert len(ttl_cache) == 1
+
+
+def test_store_survives_a_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    store = SQLiteStore(path)
+    TTLCache("youtube", store=store).set("video", {"title": "x"})
+    cache.flush_writes()
+    store.close()
+
+    store = SQLiteStore(path)
+    restarted = TTLCache("youtube", store=store)
+    assert asyncio.run(restarted.get_async("video")) == {"title": "x"}
+    # Loaded into memory, and other namespaces are separate
+    assert len(restarted) == 1
+    assert TTLCache("dalle", store=store).get("video") is None
+
+    restarted.delete("video")
+    cache.flush_writes()
+    assert TTLCache("youtube", store=store).get("video") is None
+    store.close()
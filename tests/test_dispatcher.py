@@ -0,0 +1,63 @@
+import asyncio
+
+from dispatcher import PerChatUpdateProcessor, released_slot
+from webhook_server import fake_update
+from telegram import Update
+
+
+def make_update(update_id, chat_id):
+    return Update.de_json(fake_update(update_id, chat_id, "/start"), None)
+
+
+def test_each_chat_in_order_chats_in_parallel():
+    async def main():
+        processor = PerChatUpdateProcessor(4)
+        await processor.initialize()
+        handled = []
+
+        async def handle(update, delay):
+            await asyncio.sleep(delay)
+            handled.append((update.effective_chat.id, update.update_id))
+
+        # Chat 1's first update is the slowest, yet its later ones wait for it
+        updates = [(make_update(1, 1), 0.05), (make_update(2, 1), 0.0), (make_update(3, 2), 0.01), (make_update(4, 1), 0.0)]
+        await asyncio.gather(*(processor.process_update(update, handle(update, delay)) for update, delay in updates))
+
+        assert [update_id for chat_id, update_id in handled if chat_id == 1] == [1, 2, 4]
+        # Chat 2 did not wait for chat 1
+        assert handled[0] == (2, 3)
+        assert processor.active_chats == 0
+
+    asyncio.run(main())
+
+
+def test_concurrency_cap_and_released_slot():
+    async def main():
+        processor = PerChatUpdateProcessor(2)
+        await processor.initialize()
+        running = []
+        peak = []
+        gate = asyncio.Event()
+
+        async def handle(release):
+            running.append(1)
+            peak.append(len(running))
+            if release:
+                # A handler waiting on a job queue gives its slot back meanwhile
+                running.pop()
+                async with released_slot():
+                    await gate.wait()
+                running.append(1)
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        tasks = [asyncio.create_task(processor.process_update(make_update(1, 1), handle(True)))]
+        tasks += [asyncio.create_task(processor.process_update(make_update(i, i), handle(False))) for i in range(2, 8)]
+        await asyncio.sleep(0.05)
+        # Six other chats finished on two slots while the first waited
+        assert len(peak) == 7
+        gate.set()
+        await asyncio.gather(*tasks)
+        assert max(peak) == 2
+
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+from datetime import date
+
+import pytest
+
+from quota_store import QuotaStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "quota.db")
+
+
+def test_reserve_up_to_the_limit(path):
+    store = QuotaStore(path)
+    assert [store.reserve("flux", 1, 3) for _ in range(4)] == [True, True, True, False]
+    assert store.used("flux", 1) == 3
+    assert store.remaining("flux", 1, 3) == 0
+    # Kinds and users are separate
+    assert store.reserve("upscale", 1, 3)
+    assert store.reserve("flux", 2, 3)
+    store.close()
+
+
+def test_release_is_seen_by_other_processes(path):
+    first, second = QuotaStore(path), QuotaStore(path)
+    assert first.reserve("flux", 1, 1)
+    assert not second.reserve("flux", 1, 1)
+
+    first.release("flux", 1)
+    assert second.used("flux", 1) == 0
+    assert second.reserve("flux", 1, 1)
+    first.close()
+    second.close()
+
+
+def test_release_never_goes_below_zero(path):
+    store = QuotaStore(path)
+    store.release("flux", 1)
+    assert store.used("flux", 1) == 0
+    store.close()
+
+
+def test_new_day_resets_the_count(path, monkeypatch):
+    store = QuotaStore(path)
+    today = date.today().toordinal()
+    monkeypatch.setattr(QuotaStore, "_today", staticmethod(lambda: today - 1))
+    assert store.reserve("flux", 1, 1)
+    assert not store.reserve("flux", 1, 1)
+
+    monkeypatch.setattr(QuotaStore, "_today", staticmethod(lambda: today))
+    assert store.used("flux", 1) == 0
+    assert store.reserve("flux", 1, 1)
+    store.close()
+
+
+def test_purge_old_keeps_recent_rows(path, monkeypatch):
+    store = QuotaStore(path)
+    today = date.today().toordinal()
+    monkeypatch.setattr(QuotaStore, "_today", staticmethod(lambda: today - 5))
+    store.reserve("flux", 1, 3)
+    monkeypatch.setattr(QuotaStore, "_today", staticmethod(lambda: today))
+    store.reserve("flux", 2, 3)
+
+    store.purge_old()
+    rows = store._conn.execute("SELECT user_id FROM quota").fetchall()
+    assert rows == [(2,)]
+    store.close()
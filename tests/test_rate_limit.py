@@ -0,0 +1,76 @@
+import time
+
+import rate_limit
+from rate_limit import RateLimiter, parse_limits
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_allows_up_to_the_limit_per_period(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    limiter = RateLimiter(3, 60)
+
+    assert [limiter.check(1) for _ in range(4)] == [True, True, True, False]
+    assert limiter.retry_after(1) == 60
+    # Other users are counted separately
+    assert limiter.check(2)
+
+    clock.now += 30
+    assert not limiter.check(1)
+    assert limiter.retry_after(1) == 30
+
+    clock.now += 30
+    assert limiter.retry_after(1) == 0
+    assert limiter.check(1)
+
+
+def test_window_slides(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    limiter = RateLimiter(2, 10)
+
+    assert limiter.check(1)
+    clock.now += 6
+    assert limiter.check(1)
+    clock.now += 5
+    # The first call has left the window, the second has not
+    assert limiter.check(1)
+    assert not limiter.check(1)
+
+
+def test_idle_users_are_evicted(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    limiter = RateLimiter(1, 10)
+
+    for user_id in range(5):
+        limiter.check(user_id)
+    assert len(limiter) == 5
+
+    clock.now += 11
+    limiter.check(100)
+    assert len(limiter) == 1
+
+
+def test_parse_limits_skips_invalid_rules():
+    assert parse_limits("gemma=5/60, song=10/30,,bad,zero=0/60,never=3/0") == {
+        "gemma": (5, 60.0),
+        "song": (10, 30.0)
+    }
+
+
+def test_allow_reports_the_wait():
+    import asyncio
+
+    limiter = RateLimiter(1, 60)
+    assert asyncio.run(rate_limit.allow(limiter, 1)) == (True, 0.0)
+    allowed, wait = asyncio.run(rate_limit.allow(limiter, 1))
+    assert not allowed
+    assert 59 < wait <= 60
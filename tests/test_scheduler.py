@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+import scheduler
+from scheduler import Scheduler, JobClass, QueueFull, parse_pools
+
+
+def test_admission_and_queue_full():
+    async def main():
+        job_class = JobClass("image", concurrency=2, max_queue=1)
+        first = job_class.enqueue(0)
+        second = job_class.enqueue(0)
+        assert first.done() and second.done()
+
+        waiting = job_class.enqueue(0)
+        assert not waiting.done()
+        with pytest.raises(QueueFull):
+            job_class.enqueue(0)
+        assert job_class.rejected == 1
+
+        job_class.release()
+        assert waiting.done()
+        assert (job_class.active, job_class.queued) == (2, 0)
+
+    asyncio.run(main())
+
+
+def test_freed_slot_goes_to_the_highest_priority_waiter():
+    async def main():
+        job_class = JobClass("image", concurrency=1, max_queue=5)
+        job_class.enqueue(0)
+        low = job_class.enqueue(1)
+        high = job_class.enqueue(0)
+
+        job_class.release()
+        assert high.done() and not low.done()
+        job_class.release()
+        assert low.done()
+
+    asyncio.run(main())
+
+
+def test_position_updates(monkeypatch):
+    monkeypatch.setattr(scheduler, "POSITION_UPDATE_INTERVAL", 0.05)
+
+    async def main():
+        job_class = JobClass("image", concurrency=1, max_queue=5)
+        seen = {name: [] for name in ("a", "b")}
+
+        def recorder(name):
+            async def record(position):
+                seen[name].append(position)
+            return record
+
+        job_class.enqueue(0)
+        job_class.enqueue(0, recorder("a"))
+        job_class.enqueue(0, recorder("b"))
+        await asyncio.sleep(0)
+        job_class.release()
+        await asyncio.sleep(0.1)
+
+        assert seen["a"] == [1, 0]
+        # Throttled at first, then sent by the trailing update
+        assert seen["b"] == [2, 1]
+
+    asyncio.run(main())
+
+
+def test_slot_limits_concurrency():
+    async def main():
+        jobs = Scheduler({"image": (2, 10)})
+        running = []
+        peak = []
+
+        async def job():
+            async with jobs.slot("flux"):
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+
+        await asyncio.gather(*(job() for _ in range(6)))
+        assert max(peak) == 2
+        assert jobs.classes["image"].completed == 6
+
+        # Commands without a class are not scheduled
+        async with jobs.slot("start"):
+            pass
+
+    asyncio.run(main())
+
+
+def test_submit_reports_queue_full_and_keeps_order_per_key():
+    async def main():
+        jobs = Scheduler({"image": (1, 1)})
+        results, errors = [], []
+
+        async def on_result(value):
+            results.append(value)
+
+        async def on_error(error):
+            errors.append(error)
+
+        def job(delay, value):
+            async def run():
+                await asyncio.sleep(delay)
+                return value
+            return run
+
+        jobs.submit("flux", job(0.05, "first"), on_result, on_error, key=1)
+        jobs.submit("flux", job(0.0, "second"), on_result, on_error, key=1)
+        await asyncio.sleep(0.01)
+        # Other keys queue normally: one waits, the next is turned away
+        jobs.submit("flux", job(0.0, "other"), on_result, on_error, key=2)
+        jobs.submit("flux", job(0.0, "rejected"), on_result, on_error, key=3)
+        await asyncio.sleep(0.2)
+
+        assert results.index("first") < results.index("second")
+        assert "other" in results
+        assert len(errors) == 1 and isinstance(errors[0], QueueFull)
+        await jobs.close()
+
+    asyncio.run(main())
+
+
+def test_parse_pools():
+    assert parse_pools("image=2/20, bad, speedtest=0/-1") == {"image": (2, 20), "speedtest": (1, 0)}
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        flight = SingleFlight("test")
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "value"
+
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        assert results == ["value"] * 5
+        assert len(calls) == 1
+        assert flight.stats()["joined"] == 4
+        # Forgotten once done, so the next call runs again
+        assert len(flight) == 0
+        await flight.do("key", fetch)
+        assert len(calls) == 2
+
+    asyncio.run(main())
+
+
+def test_errors_are_shared_and_not_cached():
+    async def main():
+        flight = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream down")
+
+        results = await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert len(flight) == 0
+
+    asyncio.run(main())
+
+
+def test_a_caller_giving_up_does_not_cancel_the_others():
+    async def main():
+        flight = SingleFlight("test")
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "value"
+
+        impatient = asyncio.create_task(flight.do("key", fetch))
+        patient = asyncio.create_task(flight.do("key", fetch))
+        await asyncio.sleep(0.005)
+        impatient.cancel()
+        assert await patient == "value"
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+
+    asyncio.run(main())
+
+
+def test_different_keys_run_separately():
+    async def main():
+        flight = SingleFlight("test")
+
+        async def value(name):
+            await asyncio.sleep(0.01)
+            return name
+
+        results = await asyncio.gather(flight.do("a", lambda: value("a")), flight.do("b", lambda: value("b")))
+        assert results == ["a", "b"]
+        assert flight.stats()["started"] == 2
+
+    asyncio.run(main())
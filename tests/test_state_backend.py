@@ -0,0 +1,177 @@
+import time
+import fnmatch
+
+import pytest
+
+import state_backend
+from state_backend import RedisBackend, CounterRateLimiter
+
+
+class FakeRedis:
+    """Just enough of redis.Redis for RedisBackend and RedisStore, with expiry."""
+
+    def __init__(self):
+        self.data = {}
+        self.closed = False
+
+    def _live(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and self._live(key) is not None:
+            return None
+        ttl = ex if ex is not None else px / 1000 if px is not None else None
+        self.data[key] = (str(value).encode(), time.time() + ttl if ttl is not None else None)
+        return True
+
+    def incrby(self, key, amount):
+        value = int(self._live(key) or 0) + amount
+        _, expires_at = self.data.get(key, (None, None))
+        self.data[key] = (str(value).encode(), expires_at)
+        return value
+
+    def get(self, key):
+        return self._live(key)
+
+    def pttl(self, key):
+        if self._live(key) is None:
+            return -2
+        _, expires_at = self.data[key]
+        return -1 if expires_at is None else int((expires_at - time.time()) * 1000)
+
+    def delete(self, key):
+        return 1 if self.data.pop(key, None) is not None else 0
+
+    def scan_iter(self, match="*"):
+        return [key for key in list(self.data) if fnmatch.fnmatchcase(key, match)]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def close(self):
+        self.closed = True
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self._calls.append((getattr(self._client, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        results = [call(*args, **kwargs) for call, args, kwargs in self._calls]
+        self._calls = []
+        return results
+
+
+@pytest.fixture
+def client():
+    return FakeRedis()
+
+
+@pytest.fixture
+def backend(client):
+    return RedisBackend(client=client, prefix="test:")
+
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        state_backend.StateBackend()
+
+
+def test_incr_creates_counter_with_expiry(backend, client):
+    assert backend.incr("hits", 1, ttl=30) == 1
+    assert backend.incr("hits", 2, ttl=30) == 3
+    assert backend.get_counter("hits") == 3
+    assert 0 < client.pttl("test:hits") <= 30000
+
+
+def test_incr_keeps_the_first_expiry(backend, client):
+    backend.incr("hits", 1, ttl=30)
+    backend.incr("hits", 1, ttl=300)
+    assert client.pttl("test:hits") <= 30000
+
+
+def test_expired_counter_starts_over(backend, client, monkeypatch):
+    backend.incr("hits", 5, ttl=10)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert backend.get_counter("hits") == 0
+    assert backend.incr("hits", 1, ttl=10) == 1
+
+
+def test_missing_counter_is_zero(backend):
+    assert backend.get_counter("nothing") == 0
+
+
+def test_quota_reserve_and_release(backend):
+    assert backend.reserve_quota("flux", 1, 2)
+    assert backend.reserve_quota("flux", 1, 2)
+    assert not backend.reserve_quota("flux", 1, 2)
+    assert backend.quota_used("flux", 1) == 2
+    assert backend.quota_remaining("flux", 2, 2) == 2
+
+    backend.release_quota("flux", 1)
+    assert backend.quota_remaining("flux", 1, 2) == 1
+    assert backend.reserve_quota("flux", 1, 2)
+
+
+def test_release_never_goes_below_zero(backend):
+    backend.release_quota("upscale", 1)
+    assert backend.quota_used("upscale", 1) == 0
+
+
+def test_rate_limiter_is_shared_between_workers(client):
+    first = RedisBackend(client=client, prefix="test:").rate_limiter("gemma", 3, 60)
+    second = RedisBackend(client=client, prefix="test:").rate_limiter("gemma", 3, 60)
+    assert isinstance(first, CounterRateLimiter)
+
+    assert first.check(1)
+    assert second.check(1)
+    assert first.check(1)
+    assert not second.check(1)
+    assert first.retry_after(1) > 0
+    # Other users have their own windows
+    assert second.check(2)
+
+
+def test_cache_store_round_trip(backend):
+    store = backend.cache_store
+    store.set("tmdb", "movie:1", {"title": "Heat"}, time.time() + 60)
+    value, expires_at = store.get("tmdb", "movie:1")
+    assert value == {"title": "Heat"}
+    assert expires_at == pytest.approx(time.time() + 60, abs=1)
+
+    store.delete("tmdb", "movie:1")
+    assert store.get("tmdb", "movie:1") is None
+
+
+def test_cache_store_skips_expired_values(backend):
+    backend.cache_store.set("tmdb", "old", 1, time.time() - 1)
+    assert backend.cache_store.get("tmdb", "old") is None
+
+
+def test_cache_store_clear_only_touches_its_namespace(backend):
+    store = backend.cache_store
+    store.set("tmdb", "a", 1, time.time() + 60)
+    store.set("tmdb", "b", 2, time.time() + 60)
+    store.set("youtube", "a", 3, time.time() + 60)
+
+    store.clear("tmdb")
+    assert store.get("tmdb", "a") is None
+    assert store.get("tmdb", "b") is None
+    assert store.get("youtube", "a")[0] == 3
+
+
+def test_close_closes_the_client(backend, client):
+    backend.close()
+    assert client.closed
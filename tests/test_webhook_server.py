@@ -0,0 +1,95 @@
+import asyncio
+import socket
+
+from dispatcher import PerChatUpdateProcessor
+from webhook_server import WebhookServer, post_fake_updates
+
+
+class SlowApplication:
+    """The parts of telegram.ext.Application the webhook server uses, with slow handlers."""
+
+    def __init__(self, processor, handler_time):
+        self.bot = None
+        self.update_processor = processor
+        self.handler_time = handler_time
+        self.handled = []
+        self.tasks = set()
+
+    async def process_update(self, update):
+        await asyncio.sleep(self.handler_time)
+        self.handled.append(update.update_id)
+
+    def create_task(self, coroutine, update=None):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def serve(application, **kwargs):
+    await application.update_processor.initialize()
+    server = WebhookServer(application, host="127.0.0.1", port=free_port(), path="/telegram", **kwargs)
+    await server.start()
+    return server, f"http://127.0.0.1:{server.port}/telegram"
+
+
+def test_sustained_load_gets_503():
+    async def main():
+        application = SlowApplication(PerChatUpdateProcessor(2), handler_time=0.5)
+        server, url = await serve(application, queue_size=5, batch_wait=0)
+
+        statuses = {}
+        for wave in range(4):
+            result = await post_fake_updates(url, ["/start"] * 20, users=20)
+            for status, count in result.items():
+                statuses[status] = statuses.get(status, 0) + count
+            await asyncio.sleep(0.05)
+
+        # The processor admits 2 * PENDING_PER_SLOT updates; 5 more fit in the queue
+        assert statuses.get(503, 0) > 0
+        assert server.pending <= server.max_pending
+        assert statuses[200] <= server.max_pending + 5 + server.batch_size
+
+        await server.stop()
+        await asyncio.gather(*application.tasks)
+        assert len(application.handled) == statuses[200]
+
+    asyncio.run(main())
+
+
+def test_light_load_is_accepted_and_handled():
+    async def main():
+        application = SlowApplication(PerChatUpdateProcessor(4), handler_time=0.01)
+        server, url = await serve(application, queue_size=50)
+
+        statuses = await post_fake_updates(url, ["/start"] * 30, users=5)
+        assert statuses == {200: 30}
+
+        await server.stop()
+        await asyncio.gather(*application.tasks)
+        assert sorted(application.handled) == list(range(1, 31))
+
+    asyncio.run(main())
+
+
+def test_healthz_and_wrong_path():
+    async def main():
+        import httpx
+
+        application = SlowApplication(PerChatUpdateProcessor(2), handler_time=0)
+        server, url = await serve(application, secret_token="s3cret")
+        base = url.rsplit("/", 1)[0]
+        async with httpx.AsyncClient() as client:
+            assert (await client.get(f"{base}/healthz")).status_code == 200
+            assert (await client.post(f"{base}/other", json={})).status_code == 404
+            assert (await client.get(url)).status_code == 405
+            assert (await client.post(url, json={})).status_code == 403
+        await server.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+import os
+import asyncio
+import logging
+from typing import Optional, Dict, Any, Iterable
+
+import http_client
+from cache import TTLCache
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+TMDB_API_BASE = "https://api.themoviedb.org/3"
+TMDB_LANGUAGE = "tr-TR"
+
+# Response cache settings
+TMDB_CACHE_SIZE = int(os.getenv("TMDB_CACHE_SIZE", "2000"))
+TMDB_CACHE_TTL = int(os.getenv("TMDB_CACHE_TTL", "21600"))
+# Delay between pre-warm requests, to stay well inside TMDB's rate limit
+PREWARM_REQUEST_DELAY = 0.5
+
+
+class TMDBError(Exception):
+    """TMDB answered with a non-200 status."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class TMDBClient:
+    """TMDB API client with a TTL response cache and request coalescing."""
+
+    def __init__(self, api_key: str, cache: Optional[TTLCache] = None):
+        self._api_key = api_key
+        self.cache = cache or TTLCache("tmdb", max_size=TMDB_CACHE_SIZE, ttl=TMDB_CACHE_TTL)
+        self.flight = SingleFlight("tmdb")
+        self._prewarm_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _cache_key(endpoint: str, params: Dict[str, Any]) -> str:
+        query = "&".join(f"{name}={params[name]}" for name in sorted(params))
+        return f"{endpoint}?{query}"
+
+    async def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """GET an endpoint, answering from the cache or joining an identical in-flight request."""
+        params = {'language': TMDB_LANGUAGE, **(params or {})}
+        key = self._cache_key(endpoint, params)
+
+        cached = await self.cache.get_async(key)
+        if cached is not None:
+            return cached
+
+        return await self.flight.do(key, lambda: self._fetch(endpoint, params, key))
+
+    async def _fetch(self, endpoint: str, params: Dict[str, Any], key: str) -> Dict[str, Any]:
+        response = await http_client.get(
+            f"{TMDB_API_BASE}{endpoint}",
+            params={'api_key': self._api_key, **params},
+            timeout=30
+        )
+        if response.status_code != 200:
+            raise TMDBError(response.status_code)
+
+        data = response.json()
+        self.cache.set(key, data)
+        return data
+
+    @staticmethod
+    def _discover_params(genre_id: int) -> Dict[str, Any]:
+        return {
+            'language': TMDB_LANGUAGE,
+            'sort_by': 'popularity.desc',
+            'with_genres': genre_id,
+            'page': 1
+        }
+
+    async def discover_genre(self, genre_id: int) -> Dict[str, Any]:
+        """Most popular movies of a genre."""
+        return await self.get("/discover/movie", self._discover_params(genre_id))
+
+    async def search_movie(self, query: str) -> Dict[str, Any]:
+        return await self.get("/search/movie", {'query': query.strip().lower()})
+
+    async def similar_movies(self, movie_id: int) -> Dict[str, Any]:
+        return await self.get(f"/movie/{movie_id}/similar")
+
+    def start_prewarm(self, genre_ids: Iterable[int], interval: Optional[float] = None) -> None:
+        """Keep the genre pages warm in the background, refreshing before they expire."""
+        if self._prewarm_task is None or self._prewarm_task.done():
+            interval = interval or self.cache.ttl * 0.9
+            self._prewarm_task = asyncio.create_task(self._prewarm_loop(list(genre_ids), interval))
+
+    async def _prewarm_loop(self, genre_ids: list, interval: float) -> None:
+        while True:
+            warmed = 0
+            for genre_id in genre_ids:
+                params = self._discover_params(genre_id)
+                try:
+                    # Fetch directly so the cached page is replaced before it expires
+                    await self._fetch("/discover/movie", params, self._cache_key("/discover/movie", params))
+                    warmed += 1
+                except Exception as e:
+                    logger.warning(f"TMDB pre-warm failed for genre {genre_id}: {str(e)}")
+                await asyncio.sleep(PREWARM_REQUEST_DELAY)
+            logger.info(f"TMDB pre-warm refreshed {warmed}/{len(genre_ids)} genre pages")
+            await asyncio.sleep(interval)
+
+    async def close(self) -> None:
+        if self._prewarm_task is not None:
+            self._prewarm_task.cancel()
+            try:
+                await self._prewarm_task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,157 @@
+import os
+import time
+import logging
+from collections import deque
+from typing import Optional, Dict, Any
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failures that open an upstream's circuit
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "5"))
+# How long an open circuit rejects calls; doubles each time a probe fails
+UPSTREAM_OPEN_SECONDS = float(os.getenv("UPSTREAM_OPEN_SECONDS", "30"))
+UPSTREAM_MAX_OPEN_SECONDS = float(os.getenv("UPSTREAM_MAX_OPEN_SECONDS", "300"))
+
+# Adaptive timeout: this multiple of the observed p99 latency, never below the minimum
+UPSTREAM_TIMEOUT_MULTIPLIER = float(os.getenv("UPSTREAM_TIMEOUT_MULTIPLIER", "4"))
+UPSTREAM_MIN_TIMEOUT = float(os.getenv("UPSTREAM_MIN_TIMEOUT", "2"))
+# Latency samples kept per upstream, and needed before timeouts adapt
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+
+# Statuses that mean the upstream itself is in trouble. Not 429: it usually
+# means our quota is used up (Audd.io's daily limit), not that the upstream is down
+FAILURE_STATUSES = {500, 502, 503, 504}
+
+circuit_open = metrics.registry.add(metrics.Gauge(
+    "bot_upstream_circuit_open", "1 while calls to the upstream are being rejected", ("upstream",)
+))
+adaptive_timeout = metrics.registry.add(metrics.Gauge(
+    "bot_upstream_timeout_seconds", "Current adaptive timeout per upstream", ("upstream",)
+))
+rejected_calls = metrics.registry.add(metrics.Counter(
+    "bot_upstream_rejected_total", "Calls failed fast by an open circuit", ("upstream",)
+))
+
+
+class CircuitOpenError(httpx.TransportError):
+    """The upstream is failing; the call was rejected without being sent.
+
+    It is an httpx error, so handlers report it like any connection error.
+    """
+
+    def __init__(self, upstream: str, retry_in: float):
+        super().__init__(f"{upstream} is unavailable, retrying in {retry_in:.0f}s")
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+class UpstreamHealth:
+    """Circuit breaker and latency tracker for one upstream.
+
+    Closed: calls go through. After `failure_threshold` consecutive failures
+    the circuit opens and calls fail at once. When the open period is over,
+    one probe call is let through (half-open). Its success closes the
+    circuit; its failure opens it again for twice as long.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = UPSTREAM_FAILURE_THRESHOLD, open_seconds: float = UPSTREAM_OPEN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.open_for = open_seconds
+        self.probing = False
+        self._probe_at = 0.0
+        self._latencies: "deque[float]" = deque(maxlen=LATENCY_WINDOW)
+        self._p99: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.open_for:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may be made now."""
+        state = self.state
+        if state == "closed":
+            return
+        # Let one probe through; another one if the last never reported back
+        if state == "half_open" and (not self.probing or time.monotonic() - self._probe_at > self.open_for):
+            self.probing = True
+            self._probe_at = time.monotonic()
+            return
+        rejected_calls.inc(self.name)
+        retry_in = max(0.0, self.open_for - (time.monotonic() - self.opened_at))
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self, latency: Optional[float] = None) -> None:
+        if latency is not None:
+            self._latencies.append(latency)
+            # Recomputed every few samples; sorting 200 floats is cheap but not free
+            if len(self._latencies) >= MIN_SAMPLES and len(self._latencies) % 10 == 0:
+                self._p99 = sorted(self._latencies)[int(len(self._latencies) * 0.99) - 1]
+        self.failures = 0
+        if self.opened_at is not None:
+            logger.info(f"Upstream {self.name} recovered, closing circuit")
+            self.opened_at = None
+            self.open_for = self.open_seconds
+            circuit_open.set(self.name, value=0)
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.probing:
+            # The probe failed: stay open, for longer
+            self.probing = False
+            self.opened_at = time.monotonic()
+            self.open_for = min(self.open_for * 2, UPSTREAM_MAX_OPEN_SECONDS)
+            logger.warning(f"Upstream {self.name} still failing, circuit open for {self.open_for:.0f}s")
+        elif self.opened_at is None and self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            logger.warning(f"Upstream {self.name} failed {self.failures} times, circuit open for {self.open_for:.0f}s")
+            circuit_open.set(self.name, value=1)
+
+    def timeout(self, ceiling: float) -> float:
+        """Timeout for the next call: a multiple of the p99 latency, capped by the caller's timeout."""
+        if self._p99 is None:
+            return ceiling
+        value = min(ceiling, max(UPSTREAM_MIN_TIMEOUT, self._p99 * UPSTREAM_TIMEOUT_MULTIPLIER))
+        adaptive_timeout.set(self.name, value=round(value, 3))
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "p99": round(self._p99, 3) if self._p99 is not None else None,
+            "samples": len(self._latencies)
+        }
+
+
+_upstreams: Dict[str, UpstreamHealth] = {}
+
+
+def get(name: str) -> UpstreamHealth:
+    """Health tracker for an upstream, created on first use."""
+    health = _upstreams.get(name)
+    if health is None:
+        health = _upstreams[name] = UpstreamHealth(name)
+    return health
+
+
+def is_failure_status(status_code: int) -> bool:
+    return status_code in FAILURE_STATUSES
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    return {name: health.stats() for name, health in _upstreams.items()}
@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import urllib.parse
+from typing import Optional, Dict, Any, List, Tuple
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Webhook settings
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_BATCH_WAIT = float(os.getenv("WEBHOOK_BATCH_WAIT", "0.01"))
+MAX_BODY_SIZE = 1024 * 1024
+HEADER_TIMEOUT = 30
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable"
+}
+
+
+class WebhookServer:
+    """Minimal asyncio HTTP server receiving Telegram webhook updates.
+
+    Incoming updates go into a bounded queue and the request is answered at
+    once. When the queue is full the server answers 503, so Telegram keeps
+    the update and retries later instead of it being lost. A forwarder task
+    drains the queue in batches, decodes them and hands them straight to the
+    Application's update processor, at most `max_pending` at a time. While
+    the handlers are that far behind the forwarder waits, so the queue fills
+    up and the backlog stays with Telegram rather than in process memory.
+    """
+
+    def __init__(
+        self,
+        application: Any,
+        host: str = "0.0.0.0",
+        port: int = 8443,
+        path: str = "/telegram",
+        secret_token: Optional[str] = None,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        batch_size: int = WEBHOOK_BATCH_SIZE,
+        batch_wait: float = WEBHOOK_BATCH_WAIT,
+        max_pending: Optional[int] = None
+    ):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        # Updates handed over and not yet handled; by default as many as the processor admits
+        self.max_pending = max_pending or application.update_processor.max_concurrent_updates
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=queue_size)
+        self.pending = 0
+        # Updates taken off the queue that the forwarder has yet to hand over
+        self._in_hand = 0
+        self.received = 0
+        self.rejected = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._forwarder: Optional[asyncio.Task] = None
+        self._handoff: Optional[asyncio.Semaphore] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self._handoff = asyncio.Semaphore(self.max_pending)
+        self._forwarder = asyncio.create_task(self._forward())
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        """Stop accepting updates and hand over what is already queued."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._forwarder is not None:
+            while (not self.queue.empty() or self._in_hand) and not self._forwarder.done():
+                await asyncio.sleep(0.05)
+            self._forwarder.cancel()
+            try:
+                await self._forwarder
+            except asyncio.CancelledError:
+                pass
+        logger.info(f"Webhook server stopped ({self.received} received, {self.rejected} rejected)")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # HTTP/1.1 keep-alive: serve requests until the client closes
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader), HEADER_TIMEOUT)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status = self._dispatch(method, target, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._write_response(writer, status, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            logger.warning(f"Malformed webhook request: {str(e)}")
+            await self._write_response(writer, 400, False)
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, value = line.decode("latin-1").split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_BODY_SIZE:
+            raise ValueError("body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    def _dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> int:
+        path = urllib.parse.urlparse(target).path
+        if method == "GET" and path == "/healthz":
+            return 200
+        if path != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        if self.secret_token and headers.get(SECRET_HEADER) != self.secret_token:
+            return 403
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return 503
+        self.received += 1
+        return 200
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, status: int, keep_alive: bool) -> None:
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _forward(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            for index, data in enumerate(batch):
+                self._in_hand = len(batch) - index
+                try:
+                    update = Update.de_json(data, self.application.bot)
+                except Exception as e:
+                    logger.warning(f"Dropping undecodable update: {str(e)}")
+                    continue
+                # Backpressure: wait until the handlers have room for another update.
+                # The Application's own update queue would hand every update to a new
+                # task at once, however far behind the handlers are.
+                await self._handoff.acquire()
+                self.pending += 1
+                self.application.create_task(self._process(update), update=update)
+            self._in_hand = 0
+
+    async def _process(self, update: Update) -> None:
+        try:
+            await self.application.update_processor.process_update(update, self.application.process_update(update))
+        finally:
+            self.pending -= 1
+            self._handoff.release()
+
+
+def fake_update(update_id: int, chat_id: int, text: str) -> Dict[str, Any]:
+    """Build a minimal text message update, as Telegram would post it."""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': f"User{chat_id}"}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': user['first_name']},
+            'from': user,
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] if text.startswith("/") else []
+        }
+    }
+
+
+async def post_fake_updates(url: str, texts: List[str], users: int = 10, secret_token: Optional[str] = None) -> Dict[int, int]:
+    """Post updates to a local webhook like Telegram does; returns a count per status code."""
+    import httpx
+
+    headers = {SECRET_HEADER: secret_token} if secret_token else {}
+    statuses: Dict[int, int] = {}
+    async with httpx.AsyncClient() as client:
+        async def post(update_id: int, text: str) -> None:
+            response = await client.post(url, json=fake_update(update_id, 1000 + update_id % users, text), headers=headers)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        await asyncio.gather(*(post(i, text) for i, text in enumerate(texts, 1)))
+    return statuses
+
+
+if __name__ == '__main__':
+    # Fake Telegram client: python webhook_server.py http://127.0.0.1:8443/telegram --count 100
+    parser = argparse.ArgumentParser(description="Post fake Telegram updates to a local webhook")
+    parser.add_argument("url")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--text", default="/start")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    args = parser.parse_args()
+
+    result = asyncio.run(post_fake_updates(args.url, [args.text] * args.count, args.users, args.secret))
+    print(json.dumps(result))
+    sys.exit(0 if set(result) == {200} else 1)
@@ -0,0 +1,124 @@
+import os
+import re
+import html
+import asyncio
+import logging
+from typing import Dict
+
+import http_client
+import features
+
+logger = logging.getLogger(__name__)
+
+OEMBED_URL = "https://www.youtube.com/oembed"
+WATCH_URL = "https://www.youtube.com/watch?v={video_id}"
+
+# Stop reading the watch page after this many characters
+WATCH_PAGE_MAX_CHARS = int(os.getenv("YOUTUBE_WATCH_PAGE_MAX_CHARS", "1500000"))
+# Characters carried between chunks so matches spanning a boundary are found
+CHUNK_OVERLAP = 512
+
+TITLE_PATTERN = re.compile(r'<title>(.*?) - YouTube</title>')
+AUTHOR_PATTERN = re.compile(r'"author":"([^"]+)"')
+
+
+class VideoUnavailable(Exception):
+    """The video does not exist or is private."""
+
+    def __init__(self):
+        super().__init__("Video unavailable")
+
+
+async def fetch_video_metadata(video_id: str) -> Dict[str, str]:
+    """Return the title and author of a video using the cheapest source available.
+
+    Tries the oEmbed endpoint first (a few hundred bytes), then a streamed read
+    of the watch page that stops as soon as both fields are found, then pytube.
+    """
+    video_url = WATCH_URL.format(video_id=video_id)
+
+    try:
+        return await _fetch_oembed(video_url)
+    except VideoUnavailable:
+        raise
+    except Exception as e:
+        logger.warning(f"oEmbed lookup failed for {video_id}: {str(e)}")
+
+    try:
+        return await _fetch_watch_page(video_url)
+    except VideoUnavailable:
+        raise
+    except Exception as e:
+        logger.warning(f"Watch page lookup failed for {video_id}: {str(e)}")
+
+    if not features.available("pytube"):
+        raise RuntimeError("All metadata sources failed and pytube is not installed")
+    return await asyncio.to_thread(_fetch_pytube, video_url)
+
+
+async def _fetch_oembed(video_url: str) -> Dict[str, str]:
+    params = {
+        'url': video_url,
+        'format': 'json'
+    }
+    response = await http_client.get(OEMBED_URL, params=params, timeout=10)
+
+    # 401 means embedding is disabled, the video itself may still be public
+    if response.status_code in (400, 404):
+        raise VideoUnavailable()
+    if response.status_code != 200:
+        raise Exception(f"HTTP {response.status_code}")
+
+    data = response.json()
+    if not data.get("title"):
+        raise Exception("Video başlığı alınamadı")
+    return {
+        'title': data["title"],
+        'author': data.get("author_name") or "Bilinmeyen Kanal"
+    }
+
+
+async def _fetch_watch_page(video_url: str) -> Dict[str, str]:
+    title = None
+    author = None
+    tail = ""
+    chars_read = 0
+
+    async with http_client.stream("GET", video_url, timeout=10) as response:
+        if response.status_code != 200:
+            raise Exception("Video bilgilerine erişilemedi")
+
+        async for chunk in response.aiter_text():
+            chars_read += len(chunk)
+            text = tail + chunk
+
+            if title is None:
+                title_match = TITLE_PATTERN.search(text)
+                if title_match:
+                    title = html.unescape(title_match.group(1))
+            if author is None:
+                author_match = AUTHOR_PATTERN.search(text)
+                if author_match:
+                    author = author_match.group(1)
+
+            if (title and author) or chars_read > WATCH_PAGE_MAX_CHARS:
+                break
+            tail = text[-CHUNK_OVERLAP:]
+
+    if not title:
+        raise Exception("Video başlığı alınamadı")
+    logger.info(f"Watch page metadata read after {chars_read} characters")
+    return {
+        'title': title,
+        'author': author or "Bilinmeyen Kanal"
+    }
+
+
+def _fetch_pytube(video_url: str) -> Dict[str, str]:
+    pytube = features.load("pytube")
+
+    video = pytube.YouTube(video_url)
+    return {
+        'title': video.title,
+        'author': video.author or "Bilinmeyen Kanal"
+    }